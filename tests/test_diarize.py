@@ -0,0 +1,125 @@
+"""
+Tests for the windowed diarization of `whispernote.diarize`.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("pyannote.audio")
+
+from whispernote.diarize import (  # noqa: E402
+    SAMPLE_RATE,
+    SPEAKER_MATCH_THRESHOLD,
+    check_window,
+    match_speakers,
+    window_bounds,
+)
+
+
+def _embedding(angle):
+    """Unit embedding at `angle` radians, cosine distance 1 - cos(difference)."""
+    return np.array([np.cos(angle), np.sin(angle)])
+
+
+def test_match_speakers_first_window():
+    centroids = []
+    embeddings = np.stack([_embedding(0.0), _embedding(np.pi / 2)])
+    assert match_speakers(embeddings, centroids) == [0, 1]
+    assert len(centroids) == 2
+
+
+def test_match_speakers_threshold():
+    # cosine distances just below and above the threshold
+    close = np.arccos(1 - SPEAKER_MATCH_THRESHOLD + 0.01)
+    far = np.arccos(1 - SPEAKER_MATCH_THRESHOLD - 0.01)
+
+    centroids = [_embedding(0.0)]
+    assert match_speakers(np.stack([_embedding(close)]), centroids) == [0]
+    assert len(centroids) == 1
+
+    centroids = [_embedding(0.0)]
+    assert match_speakers(np.stack([_embedding(far)]), centroids) == [1]
+    assert len(centroids) == 2
+
+
+def test_match_speakers_one_to_one():
+    # both window speakers are closest to speaker 0, only one can match it
+    centroids = [_embedding(0.0), _embedding(np.pi)]
+    embeddings = np.stack([_embedding(0.1), _embedding(0.2)])
+    assert match_speakers(embeddings, centroids) == [0, 2]
+
+
+def test_match_speakers_max_speakers():
+    # no match within the threshold, but no room for a new speaker either
+    centroids = [_embedding(0.0), _embedding(np.pi / 2)]
+    embeddings = np.stack([_embedding(np.pi / 2 + 1.5)])
+    assert match_speakers(embeddings, centroids, max_speakers=2) == [1]
+    assert len(centroids) == 2
+
+    centroids = [_embedding(0.0), _embedding(np.pi / 2)]
+    assert match_speakers(embeddings, centroids, max_speakers=3) == [2]
+    assert len(centroids) == 3
+
+
+def test_match_speakers_nan_embedding():
+    centroids = [_embedding(0.0)]
+    embeddings = np.stack([np.full(2, np.nan), _embedding(0.1)])
+    assert match_speakers(embeddings, centroids) == [1, 0]
+    # the speaker without an embedding has an empty centroid
+    np.testing.assert_array_equal(centroids[1], np.zeros(2))
+    assert np.isfinite(centroids[0]).all()
+
+
+@pytest.mark.parametrize(
+    "duration, expected_starts",
+    [
+        (1.0, [0.0]),
+        (600.0, [0.0]),
+        (600.5, [0.0, 570.0]),
+        (1170.0, [0.0, 570.0]),
+        (1171.0, [0.0, 570.0, 1140.0]),
+    ],
+)
+def test_window_bounds_starts(duration, expected_starts):
+    bounds = window_bounds(int(duration * SAMPLE_RATE), 600.0, 30.0)
+    assert [start / SAMPLE_RATE for start, _, _ in bounds] == expected_starts
+    # the last window reaches the end of the audio
+    assert bounds[-1][0] + 600.0 * SAMPLE_RATE >= duration * SAMPLE_RATE
+
+
+def test_window_bounds_keep_regions():
+    bounds = window_bounds(int(1500.0 * SAMPLE_RATE), 600.0, 30.0)
+    assert [(keep_start, keep_end) for _, keep_start, keep_end in bounds] == [
+        (0.0, 585.0),
+        (15.0, 585.0),
+        (15.0, 600.0),
+    ]
+
+    # the kept regions tile the audio, without gaps or overlaps
+    kept = [
+        (start / SAMPLE_RATE + keep_start, start / SAMPLE_RATE + keep_end)
+        for start, keep_start, keep_end in bounds
+    ]
+    assert kept[0][0] == 0.0
+    for (_, end), (start, _) in zip(kept, kept[1:]):
+        assert end == start
+
+
+def test_window_bounds_single_window_keeps_all():
+    assert window_bounds(SAMPLE_RATE, 600.0, 30.0) == [(0, 0.0, 600.0)]
+
+
+@pytest.mark.parametrize("window, overlap", [(30.0, 30.0), (10.0, 30.0), (0.0, 0.0)])
+def test_window_bounds_rejects_short_window(window, overlap):
+    with pytest.raises(ValueError):
+        window_bounds(10 * SAMPLE_RATE, window, overlap)
+
+
+@pytest.mark.parametrize("window", [0.0, 31.0, 600.0])
+def test_check_window_accepts(window):
+    check_window(window, 30.0)
+
+
+@pytest.mark.parametrize("window", [-1.0, 1.0, 30.0])
+def test_check_window_rejects(window):
+    with pytest.raises(ValueError):
+        check_window(window, 30.0)
@@ -0,0 +1,180 @@
+"""
+Tests for the speaker matching of `whispernote.subtitle`, and the joining of
+`whispernote.models.Subtitles`.
+"""
+import numpy as np
+import pytest
+
+from whispernote.models.SubtitleElement import SubtitleElement
+from whispernote.models.Subtitles import Subtitles
+from whispernote.subtitle import match_speaker_turns
+
+
+def _match_brute_force(start, end, turn_start, turn_end):
+    """
+    Reference implementation of `match_speaker_turns`: the turn each segment
+    overlaps the most (ties: the last turn), or contains the segment.
+    """
+    turn_idxs = np.full(len(start), -1)
+    for seg_idx, (seg_start, seg_end) in enumerate(zip(start, end)):
+        best_overlap = None
+        for turn_idx, (t_start, t_end) in enumerate(zip(turn_start, turn_end)):
+            overlap = min(t_end, seg_end) - max(t_start, seg_start)
+            inside = t_start <= seg_start and seg_end <= t_end
+            if (overlap > 0 or inside) and (
+                best_overlap is None or overlap >= best_overlap
+            ):
+                turn_idxs[seg_idx] = turn_idx
+                best_overlap = overlap
+    return turn_idxs
+
+
+@pytest.mark.parametrize(
+    "segment, turn, expected",
+    [
+        ((16, 16), (15, 16), 0),  # zero length, on the end of the turn
+        ((15, 15), (15, 16), 0),  # zero length, on the start of the turn
+        ((10, 15), (15, 20), -1),  # only touches the turn
+        ((14, 18), (15, 20), 0),
+    ],
+)
+def test_match_speaker_turns_boundaries(segment, turn, expected):
+    turn_idxs = match_speaker_turns(
+        np.array([segment[0]]),
+        np.array([segment[1]]),
+        np.array([turn[0]]),
+        np.array([turn[1]]),
+    )
+    assert turn_idxs.tolist() == [expected]
+
+
+def test_match_speaker_turns_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(2000):
+        turn_start = np.sort(rng.integers(0, 30, rng.integers(0, 6)))
+        turn_end = turn_start + rng.integers(0, 8, len(turn_start))
+        start = rng.integers(0, 30, rng.integers(0, 6))
+        end = start + rng.integers(0, 6, len(start))
+
+        expected = _match_brute_force(start, end, turn_start, turn_end)
+        actual = match_speaker_turns(start, end, turn_start, turn_end)
+        np.testing.assert_array_equal(actual, expected)
+
+
+def _join_reference(elements, max_words_per_line):
+    """
+    Reference implementation of `Subtitles.join_adjacent_elements`: the list-based
+    join the columns replaced, on (index, start_ms, end_ms, speaker, text) tuples.
+    """
+    elements = [list(element) for element in elements]
+    idx = 0
+    while idx < len(elements) - 1:
+        element = elements[idx]
+        next_element = elements[idx + 1]
+        if (
+            element[3] == next_element[3]
+            and element[4][-1] not in [".", "?", "!"]
+            and len(element[4].split(" ")) < max_words_per_line
+        ):
+            element[4] = element[4].strip() + " " + next_element[4].strip()
+            element[2] = next_element[2]
+            elements.remove(next_element)
+        else:
+            idx += 1
+    return [tuple(element) for element in elements]
+
+
+def _make_subtitles(speakers, texts):
+    subtitles = Subtitles()
+    for idx, (speaker, text) in enumerate(zip(speakers, texts)):
+        subtitles.add_element(
+            SubtitleElement(
+                start_ms=1000 * idx, end_ms=1000 * idx + 900, text=text, speaker=speaker
+            )
+        )
+    return subtitles
+
+
+def _columns(subtitles):
+    return list(
+        zip(
+            subtitles.indices.tolist(),
+            subtitles.start_ms.tolist(),
+            subtitles.end_ms.tolist(),
+            subtitles.speakers.tolist(),
+            subtitles.texts,
+        )
+    )
+
+
+def _assert_join_matches_reference(speakers, texts, max_words_per_line):
+    subtitles = _make_subtitles(speakers, texts)
+    before = _columns(subtitles)
+    expected = _join_reference(before, max_words_per_line)
+
+    joined = subtitles.joined(max_words_per_line=max_words_per_line)
+    # NaN speakers do not compare equal, so compare them by their rendering
+    assert repr(_columns(joined)) == repr(expected)
+    assert repr(_columns(subtitles)) == repr(before)
+
+    subtitles.join_adjacent_elements(max_words_per_line=max_words_per_line)
+    assert repr(_columns(subtitles)) == repr(expected)
+    assert len(subtitles.elements) == len(expected)
+
+
+def test_join_empty():
+    subtitles = Subtitles()
+    assert _columns(subtitles.joined()) == []
+    subtitles.join_adjacent_elements()
+    assert _columns(subtitles) == []
+    assert str(subtitles) == ""
+
+
+def test_join_single_element():
+    _assert_join_matches_reference(["SPEAKER_00"], ["hello there"], 7)
+
+
+@pytest.mark.parametrize(
+    "texts, max_words_per_line",
+    [
+        # the line reaches the limit exactly, and is not joined further
+        (["one two", "three", "four"], 3),
+        # one word below the limit, so the next element joins, over the limit
+        (["one", "two three four", "five"], 3),
+        # a single element over the limit
+        (["one two three four", "five"], 3),
+        (["one", "two", "three", "four", "five"], 1),
+        (["one", "two", "three", "four", "five"], 2),
+    ],
+)
+def test_join_word_limit(texts, max_words_per_line):
+    _assert_join_matches_reference(
+        ["SPEAKER_00"] * len(texts), texts, max_words_per_line
+    )
+
+
+def test_join_stop_characters():
+    texts = ["Hello.", "how are", "you?", "fine", "thanks!", "bye"]
+    _assert_join_matches_reference(["SPEAKER_00"] * len(texts), texts, 7)
+
+
+def test_join_nan_speakers():
+    # without diarization, no element has a speaker, and none are joined
+    nan = float("nan")
+    _assert_join_matches_reference([nan, nan, nan], ["one", "two", "three"], 7)
+    _assert_join_matches_reference(
+        [nan, "SPEAKER_00", "SPEAKER_00", nan], ["one", "two", "three", "four"], 7
+    )
+
+
+def test_join_random():
+    rng = np.random.default_rng(0)
+    words = ["a", "b.", "c?", "d!", "e", "f g", "h i j"]
+    for _ in range(500):
+        size = int(rng.integers(0, 12))
+        speakers = [
+            ["SPEAKER_00", "SPEAKER_01", float("nan")][speaker]
+            for speaker in rng.integers(0, 3, size)
+        ]
+        texts = [words[word] for word in rng.integers(0, len(words), size)]
+        _assert_join_matches_reference(speakers, texts, int(rng.integers(1, 6)))
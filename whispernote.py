@@ -5,41 +5,40 @@ Runner script for WhisperNote.
 from rich.console import Console
 from rich.logging import RichHandler
 
-console = Console()
+# Spawned workers re-import this module as "__mp_main__"; keep them quiet
+console = Console(quiet=__name__ == "__mp_main__")
 
 with console.status("[green]Loading...") as status:
     import sys
     from pathlib import Path
 
-    file = Path(__file__).resolve()
-    parent = file.parent
-    ROOT = None
-    for parent in file.parents:
-        if parent.name == "WhisperNote":
-            ROOT = parent
-    sys.path.append(str(ROOT))
-
-    # remove current directory from path
-    try:
-        sys.path.remove(str(parent))
-    except ValueError:
-        pass
+    # The whispernote package sits next to this script
+    ROOT = Path(__file__).resolve().parent
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
 
     status.update("[bold green]Importing modules...")
     import argparse
+    import atexit
     import concurrent.futures
     import logging
+    import logging.handlers
+    import multiprocessing
+    import multiprocessing.connection
     import os
-    import subprocess
+    import queue
     import tempfile
-    from typing import Dict, List, Optional
-
-    import pyfiglet
+    from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
     import whispernote.helpers.utils as utils
-    from whispernote import diarize, subtitle, transcribe
+
+    if TYPE_CHECKING:
+        import pandas as pd
+        from pyannote.core.annotation import Annotation
 
 MODULE_NAME = "whispernote"
+# config.ini sits next to this script, at the root of the repository
+CONFIG_FILE = ROOT / "config.ini"
 
 logger = logging.getLogger(MODULE_NAME)
 logargs = {
@@ -51,105 +50,336 @@ logargs = {
 logging.basicConfig(**logargs)
 
 
-def run_parallel(args, log_file: str) -> Dict[str, concurrent.futures.Future]:
+def add_file_handler(log_file: str) -> None:
     """
-    Runs transcription and diarization jobs in parallel using ThreadPoolExecutor.
+    Attaches a DEBUG level file handler to the root logger.
+
+    Records are handed to the file handler through a queue and written by a
+    background thread, so logging never blocks on disk I/O. The thread is stopped
+    (and the queue flushed) at exit.
+
+    Args:
+        log_file: Path to the log file.
+
+    Returns:
+        None
+    """
+    file_handler = logging.FileHandler(log_file, mode="a")
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(
+        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    )
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
+    logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def _pin_gpu(gpu_idx: Optional[int]) -> None:
+    """
+    Restricts the current process to a single GPU. Must be called before torch is
+    imported.
+
+    Args:
+        gpu_idx: Index of the GPU, as reported by nvidia-smi. None to leave the
+            visible devices unchanged.
+
+    Returns:
+        None
+    """
+    if gpu_idx is None:
+        return
+    # Match nvidia-smi's device numbering
+    os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_idx)
+    logger.info(f"Pinned {multiprocessing.current_process().name} to GPU {gpu_idx}")
+
+
+def _transcribe_target(
+    args,
+    transcript_output: str,
+    log_file: str,
+    gpu_idx: Optional[int] = None,
+) -> None:
+    """
+    Transcription job, run in its own process by `run_parallel`.
 
     Args:
         args: An object containing the command line arguments.
+        transcript_output: Path to the output transcript file.
+        log_file: Path to the log file.
+        gpu_idx: Index of the GPU to run on.
 
     Returns:
-        A dictionary containing the futures of the transcription and diarization tasks.
+        None
     """
-    futures: Dict[str, concurrent.futures.Future] = {}
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=4, thread_name_prefix="whispernote"
-    ) as executor:
-        if args.transcript_output:
-            logger.info(f"Submitting transcription job for {args.input}")
-
-            command_array = [
-                "python",
-                os.path.join(utils.get_repo_root(), "WhisperNote", "whispernote", "transcribe.py"),
-                "--input",
-                args.input,
-                "--output",
-                args.transcript_output,
-                "--model",
-                args.transcript_model,
-                "--log-file",
+    add_file_handler(log_file)
+    _pin_gpu(gpu_idx)
+    from whispernote import transcribe
+
+    transcript = transcribe.transcribe(
+        input_audio_file_path=args.input,
+        model=args.transcript_model,
+        language=args.language,
+        condition_on_previous_text=args.condition_on_previous_text,
+        beam_size=args.beam_size,
+        backend=args.transcription_backend,
+    )
+    transcribe.write_output(transcript_output, transcript)
+
+
+def _diarize_target(
+    args,
+    diarization_output: str,
+    log_file: str,
+    gpu_idx: Optional[int] = None,
+    params: Optional[dict] = None,
+) -> None:
+    """
+    Diarization job, run in its own process by `run_parallel`.
+
+    Args:
+        args: An object containing the command line arguments.
+        diarization_output: Path to the output diarization file.
+        log_file: Path to the log file.
+        gpu_idx: Index of the GPU to run on.
+        params: Parsed "whispernote" config section, so the worker does not have to
+            locate and read the config file again.
+
+    Returns:
+        None
+    """
+    add_file_handler(log_file)
+    _pin_gpu(gpu_idx)
+    utils.set_cuda_alloc_conf()
+    from whispernote import diarize
+
+    hugging_face_key = diarize.get_huggingface_key(params)
+    diarization = diarize.diarize(
+        audio_path=args.input,
+        hugging_face_key=hugging_face_key,
+        speaker_count=args.speaker_count,
+        min_speakers=args.min_speakers,
+        max_speakers=args.max_speakers,
+        embedding_batch_size=args.embedding_batch_size,
+        segmentation_batch_size=args.segmentation_batch_size,
+        window=args.diarization_window,
+    )
+    diarize.write_output(diarization_output, diarization)
+
+
+def _stop_process(
+    process: multiprocessing.process.BaseProcess, timeout: float = 10.0
+) -> None:
+    """
+    Stops a worker process if it is still running. The process is sent SIGTERM
+    first, and killed if it has not exited after `timeout` seconds (e.g. when
+    stuck in a CUDA call).
+
+    Args:
+        process: The process to stop.
+        timeout: Seconds to wait for the process to exit after SIGTERM.
+
+    Returns:
+        None
+    """
+    if not process.is_alive():
+        return
+    logger.error(f"Terminating {process.name}")
+    process.terminate()
+    process.join(timeout)
+    if process.is_alive():
+        logger.error(f"{process.name} did not exit, killing it")
+        process.kill()
+        process.join()
+
+
+def run_parallel(
+    args,
+    log_file: str,
+    transcript_output: Optional[str] = None,
+    diarization_output: Optional[str] = None,
+    params: Optional[dict] = None,
+    gpu_idxs: Optional[List[int]] = None,
+) -> Dict[str, Optional[int]]:
+    """
+    Runs transcription and diarization jobs in parallel, each in its own process.
+
+    The library functions are called directly in the child processes, which are
+    started with the "spawn" method so that CUDA is initialized cleanly in each.
+    Each process is pinned to its own GPU via CUDA_VISIBLE_DEVICES, as both models
+    sharing a single GPU thrash its memory.
+
+    Args:
+        args: An object containing the command line arguments.
+        log_file: Path to the log file.
+        transcript_output: Path to the output transcript file.
+        diarization_output: Path to the output diarization file.
+        params: Parsed "whispernote" config section, passed on to the workers.
+        gpu_idxs: GPUs to run on, one per process (transcription first). If not
+            provided, the processes pick their GPU themselves.
+
+    Returns:
+        A dictionary containing the exit codes of the transcription and diarization
+        processes.
+
+    Raises:
+        RuntimeError: If either process fails. The other process is terminated.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    processes: Dict[str, multiprocessing.process.BaseProcess] = {}
+    free_gpu_idxs = list(gpu_idxs or [])
+
+    if transcript_output:
+        logger.info(f"Starting transcription process for {args.input}")
+        processes["transcription"] = ctx.Process(
+            target=_transcribe_target,
+            args=(
+                args,
+                transcript_output,
                 log_file,
-                "--condition-on-previous-text",
-                str(args.condition_on_previous_text),
-                "--beam-size",
-                str(args.beam_size),
-            ]
-            if args.language:
-                command_array.extend(["--language", args.language])
-
-            transcription_task = executor.submit(
-                utils.execute_commands,
-                command_array,
-                shell=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            futures["transcription"] = transcription_task
-
-        if args.diarization_output:
-            logger.info(f"Submitting diarization job for {args.input}")
-            command_array = [
-                "python",
-                os.path.join(utils.get_repo_root(), "WhisperNote", "whispernote", "diarize.py"),
-                "--input",
-                args.input,
-                "--output",
-                args.diarization_output,
-                "--log-file",
+                free_gpu_idxs.pop(0) if free_gpu_idxs else None,
+            ),
+            name="whispernote-transcription",
+        )
+
+    if diarization_output:
+        logger.info(f"Starting diarization process for {args.input}")
+        processes["diarization"] = ctx.Process(
+            target=_diarize_target,
+            args=(
+                args,
+                diarization_output,
                 log_file,
-            ]
-            if args.speaker_count:
-                command_array.extend(["--speaker-count", str(args.speaker_count)])
-            if args.min_speakers:
-                command_array.extend(["--min-speakers", str(args.min_speakers)])
-            if args.max_speakers:
-                command_array.extend(["--max-speakers", str(args.max_speakers)])
-
-            diarization_task = executor.submit(
-                utils.execute_commands,
-                command_array,
-                shell=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            futures["diarization"] = diarization_task
+                free_gpu_idxs.pop(0) if free_gpu_idxs else None,
+                params,
+            ),
+            name="whispernote-diarization",
+        )
 
-        # Run the processes
-        tasks_completed = 0
-        for task in concurrent.futures.as_completed(futures.values()):
-            tasks_completed += 1
-            task_name = [k for k, v in futures.items() if v == task][0]
-            logger.info(
-                f"Completed {tasks_completed} of {len(futures)} tasks: {task_name}"
-            )
+    for process in processes.values():
+        process.start()
 
-    return futures
+    # Report tasks in the order they actually finish
+    name_by_sentinel = {
+        process.sentinel: task_name for task_name, process in processes.items()
+    }
+    pending = list(name_by_sentinel)
+    exit_codes: Dict[str, Optional[int]] = {}
+    try:
+        while pending:
+            for sentinel in multiprocessing.connection.wait(pending):
+                pending.remove(sentinel)
+                task_name = name_by_sentinel[sentinel]
+                process = processes[task_name]
+                process.join()
+                exit_codes[task_name] = process.exitcode
+                if process.exitcode != 0:
+                    logger.error(
+                        f"{task_name} failed with exit code {process.exitcode}"
+                    )
+                    raise RuntimeError(
+                        f"{task_name} failed with exit code {process.exitcode}"
+                    )
+                logger.info(
+                    f"Completed {len(exit_codes)} of {len(processes)} tasks: {task_name}"
+                )
+    finally:
+        # Reached with processes still running only on failure or interrupt
+        for process in processes.values():
+            _stop_process(process)
+
+    return exit_codes
+
+
+def _load_transcript_df(transcript: Union[str, Dict[str, Any]]) -> "pd.DataFrame":
+    """
+    Loads the transcript for subtitle generation. Run on a background thread by
+    `run_whispernote`, so pandas is imported and the transcript parsed while the
+    diarization runs.
+
+    Args:
+        transcript: Path to the transcript file, or the transcription result.
+
+    Returns:
+        The transcript, as returned by `subtitle.load_transcript_df`.
+    """
+    from whispernote import subtitle
+
+    return subtitle.load_transcript_df(transcript)
+
+
+def generate_subtitles(
+    transcript: Union[str, Dict[str, Any]],
+    diarization: Union[str, "Annotation"],
+    srt_output: str,
+    transcribeme_output: Optional[str] = None,
+    max_words_per_line: int = 7,
+    transcript_df: Optional["pd.DataFrame"] = None,
+) -> None:
+    """
+    Generates the diarized SRT (and TranscribeMe) files from the transcript and
+    diarization.
+
+    Args:
+        transcript: Path to the transcript file, or the transcription result.
+        diarization: Path to the diarization file, or the diarization result.
+        srt_output: Path to the output SRT file.
+        transcribeme_output: Path to the output TranscribeMe file, if requested.
+        max_words_per_line: Maximum number of words per subtitle line.
+        transcript_df: Transcript already loaded with `subtitle.load_transcript_df`.
+
+    Returns:
+        None
+    """
+    from whispernote import subtitle
+
+    logger.info(f"Max words per subtitle line: {max_words_per_line}")
+    subtitle.generate_diarized_subtitles(
+        whisper_json=transcript,
+        diarization_path=diarization,
+        srt_path=srt_output,
+        transcribeMe_path=transcribeme_output,
+        max_words_per_line=max_words_per_line,
+        transcript_df=transcript_df,
+    )
+    logger.info(f"Generated Diarized SRT at {srt_output}")
+    if transcribeme_output:
+        logger.info(f"Generated Diarized TranscribeMe at {transcribeme_output}")
 
 
 def run_whispernote(
     audio_input: str,
-    transcript_output: str,
-    diarization_output: str,
-    srt_output: str,
+    transcript_output: Optional[str],
+    diarization_output: Optional[str],
+    srt_output: Optional[str],
     transcript_model: str,
     language: Optional[str] = None,
     speaker_count: Optional[int] = None,
     min_speakers: Optional[int] = None,
     max_speakers: Optional[int] = None,
+    params: Optional[dict] = None,
+    transcribeme_output: Optional[str] = None,
+    condition_on_previous_text: bool = True,
+    beam_size: Optional[int] = None,
+    embedding_batch_size: int = 8,
+    segmentation_batch_size: int = 8,
+    transcription_backend: str = "openai",
+    diarization_window: float = 600.0,
 ) -> None:
     """
     Runs Transcription, Diarization, and SRT generation in sequence.
 
+    When an SRT file is requested, the transcription and diarization results are
+    handed to the subtitle generation in memory, and the transcript is prepared for
+    it on a background thread while the diarization runs. The transcript and
+    diarization are only written to disk if their outputs were requested.
+
     Args:
         audio_input: Path to the input audio file.
         transcript_output: Path to the output transcript file.
@@ -160,44 +390,82 @@ def run_whispernote(
         speaker_count: Number of speakers, if known.
         min_speakers: Minimum number of speakers, if known.
         max_speakers: Maximum number of speakers, if known.
+        params: Parsed "whispernote" config section. Read from the config file
+            if not provided.
+        transcribeme_output: Path to the output TranscribeMe file, if requested.
+        condition_on_previous_text: Condition transcription on previous text.
+        beam_size: Beam size to use for transcription.
+        embedding_batch_size: Batch size of the speaker embedding model.
+        segmentation_batch_size: Batch size of the segmentation model.
+        transcription_backend: Transcription backend, "openai" (openai-whisper) or
+            "faster" (faster-whisper).
+        diarization_window: Length of the windows long audio is diarized in, in
+            seconds. 0 diarizes the whole file at once.
 
     Returns:
         None
+
+    Raises:
+        ValueError: If the diarization window is not longer than its overlap.
     """
-    if transcript_output:
-        logger.info(f"Running transcription for {audio_input}")
-        transcript = transcribe.transcribe(
-            input_audio_file_path=audio_input,
-            model=transcript_model,
-            language=language,
-        )
-        transcribe.write_output(transcript_output, transcript)
-        logger.info(f"Generated transcript output at {transcript_output}")
+    # Imported here, as these pull in torch, whisper and pyannote
+    from whispernote import diarize, transcribe
 
-    if diarization_output:
-        logger.info(f"Running diarization for {audio_input}")
-        hugging_face_key = diarize.get_huggingface_key()
-        diarization = diarize.diarize(
-            audio_path=audio_input,
-            hugging_face_key=hugging_face_key,
-            speaker_count=speaker_count,
-            min_speakers=min_speakers,
-            max_speakers=max_speakers,
-        )
-        diarize.write_output(diarization_output, diarization)
-        logger.info(f"Generated Diarization output at {diarization_output}")
-
-    if srt_output:
-        logger.info(f"Generating Diarized SRT file for {audio_input}")
-        subtitle_params = utils.config(utils.get_config_file(), "subtitles")
-        max_words_per_line = int(subtitle_params["max_words_per_line"])
-        subtitle.generate_diarized_subtitles(
-            whisper_json=transcript_output,
-            diarization_path=diarization_output,
-            srt_path=srt_output,
-            max_words_per_line=max_words_per_line,
-        )
-        logger.info(f"Generated Diarized SRT at {srt_output}")
+    # Checked before transcribing, which would otherwise be wasted
+    diarize.check_window(diarization_window, diarize.WINDOW_OVERLAP)
+
+    if params is None:
+        params = utils.config(os.fspath(CONFIG_FILE), "whispernote")
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="whispernote"
+    ) as executor:
+        transcript_df_task = None
+
+        if transcript_output or srt_output:
+            logger.info(f"Running transcription for {audio_input}")
+            transcript = transcribe.transcribe(
+                input_audio_file_path=audio_input,
+                model=transcript_model,
+                language=language,
+                condition_on_previous_text=condition_on_previous_text,
+                beam_size=beam_size,
+                backend=transcription_backend,
+            )
+            if transcript_output:
+                transcribe.write_output(transcript_output, transcript)
+                logger.info(f"Generated transcript output at {transcript_output}")
+
+            if srt_output:
+                transcript_df_task = executor.submit(_load_transcript_df, transcript)
+
+        if diarization_output or srt_output:
+            logger.info(f"Running diarization for {audio_input}")
+            hugging_face_key = diarize.get_huggingface_key(params)
+            diarization = diarize.diarize(
+                audio_path=audio_input,
+                hugging_face_key=hugging_face_key,
+                speaker_count=speaker_count,
+                min_speakers=min_speakers,
+                max_speakers=max_speakers,
+                embedding_batch_size=embedding_batch_size,
+                segmentation_batch_size=segmentation_batch_size,
+                window=diarization_window,
+            )
+            if diarization_output:
+                diarize.write_output(diarization_output, diarization)
+                logger.info(f"Generated Diarization output at {diarization_output}")
+
+        if srt_output and transcript_df_task is not None:
+            logger.info(f"Generating Diarized SRT file for {audio_input}")
+            generate_subtitles(
+                transcript=transcript,
+                diarization=diarization,
+                srt_output=srt_output,
+                transcribeme_output=transcribeme_output,
+                max_words_per_line=int(params["subtitle_max_words_per_line"]),
+                transcript_df=transcript_df_task.result(),
+            )
 
     logger.info("WhisperNote run complete")
     return
@@ -210,21 +478,20 @@ def main():
     Returns:
         None
     """
-    log_params = utils.config(utils.get_config_file(), "logging")
+    cfg = utils.config(os.fspath(CONFIG_FILE))
+    log_params = cfg["logging"]
     log_file = log_params[MODULE_NAME]
-    file_handler = logging.FileHandler(log_file, mode="a")
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(
-        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    )
-    logging.getLogger().addHandler(file_handler)
+    add_file_handler(log_file)
+
+    # Before CUDA is first used, by the transcription or the diarization
+    utils.set_cuda_alloc_conf()
 
     parser = argparse.ArgumentParser(description="WhisperNote")
 
     parser.add_argument("--input", type=str, help="input audio file", required=True)
     parser.add_argument(
         "--parallel",
-        type=bool,
+        action=argparse.BooleanOptionalAction,
         help="run processes in parallel",
         required=False,
         default=False,
@@ -261,6 +528,13 @@ def main():
         choices=["tiny", "base", "small", "medium", "large"],
         default="large",
     )
+    parser.add_argument(
+        "--transcription-backend",
+        type=str,
+        help="transcription backend: openai-whisper, or faster-whisper (int8 quantized)",
+        choices=["openai", "faster"],
+        default="openai",
+    )
     parser.add_argument(
         "--speaker-count", type=int, help="number of speakers, if known", required=False
     )
@@ -282,9 +556,27 @@ def main():
         help="language of the audio file, if known",
         required=False,
     )
+    parser.add_argument(
+        "--embedding-batch-size",
+        type=int,
+        help="batch size of the speaker embedding model (diarization)",
+        default=8,
+    )
+    parser.add_argument(
+        "--segmentation-batch-size",
+        type=int,
+        help="batch size of the segmentation model (diarization)",
+        default=8,
+    )
+    parser.add_argument(
+        "--diarization-window",
+        type=float,
+        help="diarize audio longer than this in windows of this many seconds, 0 to disable",
+        default=600.0,
+    )
 
     args = parser.parse_args()
-    params = utils.config(utils.get_config_file(), "whispernote")
+    params = cfg["whispernote"]
     args.condition_on_previous_text = params["condition_on_previous_text"]
     if (
         args.condition_on_previous_text == "True"
@@ -312,13 +604,22 @@ def main():
 
     logger.info(f"Arguments: {args}")
 
-    title = pyfiglet.figlet_format("WhisperNote", font="slant")
-    console.print(f"[bold red]{title}")
+    console.print(f"[bold red]{utils.BANNER}")
 
     temp_files: List[tempfile._TemporaryFileWrapper] = []
 
-    if srt_output:
-        if not transcript_output:
+    gpu_idxs: List[int] = []
+    if args.parallel:
+        gpu_idxs = utils.get_free_gpu_idxs() if utils.check_gpu() else []
+        if len(gpu_idxs) < 2:
+            logger.warning(
+                f"Parallel mode needs 2 GPUs, found {len(gpu_idxs)}. Running sequentially"
+            )
+            args.parallel = False
+
+    if args.parallel:
+        # The workers hand their results back through files
+        if srt_output and not transcript_output:
             logger.info(
                 "SRT output requested, but transcript output not requested. Using temp file"
             )
@@ -326,7 +627,7 @@ def main():
             transcript_output = temp_file.name
             logger.debug(f"Using temp file {transcript_output}")
             temp_files.append(temp_file)
-        if not diarization_output:
+        if srt_output and not diarization_output:
             logger.info(
                 "SRT output requested, but diarization output not requested. Using temp file"
             )
@@ -335,57 +636,44 @@ def main():
             logger.debug(f"Using temp file {diarization_output}")
             temp_files.append(temp_file)
 
-    if args.parallel:
         logger.info("Running transcription and diarization in parallel")
-        run_parallel(args, log_file=log_file)
-    else:
-        if transcript_output:
-            logger.info(f"Running transcription for {args.input}")
-            transcript = transcribe.transcribe(
-                input_audio_file_path=args.input,
-                model=args.transcript_model,
-                language=args.language,
-                condition_on_previous_text=args.condition_on_previous_text,
-                beam_size=args.beam_size,
-            )
-            transcribe.write_output(transcript_output, transcript)
-            logger.info(f"Generated transcript output at {transcript_output}")
-
-        if diarization_output:
-            logger.info(f"Running diarization for {args.input}")
-            hugging_face_key = diarize.get_huggingface_key()
-            diarization = diarize.diarize(
-                audio_path=args.input,
-                hugging_face_key=hugging_face_key,
-                speaker_count=args.speaker_count,
-                min_speakers=args.min_speakers,
-                max_speakers=args.max_speakers,
-            )
-            diarize.write_output(diarization_output, diarization)
-            logger.info(f"Generated Diarization output at {diarization_output}")
-
-    if srt_output:
-        logger.info(f"Generating Diarized SRT file for {args.input}")
-        transcribeme_output = args.transcribeme_output
-        subtitle_max_words_per_line = int(params["subtitle_max_words_per_line"])
-        logger.info(f"Max words per subtitle line: {subtitle_max_words_per_line}")
-        if not transcribeme_output:
-            logger.info(
-                "SRT output requested, but transcribeMe output not requested. Using temp file"
+        run_parallel(
+            args,
+            log_file=log_file,
+            transcript_output=transcript_output,
+            diarization_output=diarization_output,
+            params=params,
+            gpu_idxs=gpu_idxs[:2],
+        )
+        if srt_output:
+            logger.info(f"Generating Diarized SRT file for {args.input}")
+            generate_subtitles(
+                transcript=transcript_output,
+                diarization=diarization_output,
+                srt_output=srt_output,
+                transcribeme_output=args.transcribeme_output,
+                max_words_per_line=int(params["subtitle_max_words_per_line"]),
             )
-            temp_file = tempfile.NamedTemporaryFile(suffix=".txt")
-            transcribeme_output = temp_file.name
-            logger.debug(f"Using temp file {transcribeme_output}")
-            temp_files.append(temp_file)
-        subtitle.generate_diarized_subtitles(
-            whisper_json=transcript_output,
-            diarization_path=diarization_output,
-            srt_path=srt_output,
-            transcribeMe_path=transcribeme_output,
-            max_words_per_line=subtitle_max_words_per_line,
+    else:
+        run_whispernote(
+            audio_input=args.input,
+            transcript_output=transcript_output,
+            diarization_output=diarization_output,
+            srt_output=srt_output,
+            transcript_model=args.transcript_model,
+            language=args.language,
+            speaker_count=args.speaker_count,
+            min_speakers=args.min_speakers,
+            max_speakers=args.max_speakers,
+            params=params,
+            transcribeme_output=args.transcribeme_output,
+            condition_on_previous_text=args.condition_on_previous_text,
+            beam_size=args.beam_size,
+            embedding_batch_size=args.embedding_batch_size,
+            segmentation_batch_size=args.segmentation_batch_size,
+            transcription_backend=args.transcription_backend,
+            diarization_window=args.diarization_window,
         )
-        logger.info(f"Generated Diarized SRT at {srt_output}")
-        logger.info(f"Generated Diarized TranscribeMe at {transcribeme_output}")
 
     for temp_file in temp_files:
         logger.debug(f"Deleting temp file {temp_file.name}")
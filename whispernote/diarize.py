@@ -6,67 +6,109 @@ Diarize audio file using pyannote speaker diarization model.
 import sys
 from pathlib import Path
 
-file = Path(__file__).resolve()
-parent = file.parent
-ROOT = None
-for parent in file.parents:
-    if parent.name == "WhisperNote":
-        ROOT = parent
-sys.path.append(str(ROOT))
-
-# remove current directory from path
-try:
-    sys.path.remove(str(parent))
-except ValueError:
-    pass
+# When run as a script, make the `whispernote` package importable from the repo root
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
 import argparse
+import concurrent.futures
+import contextlib
+import functools
 import logging
-from typing import Optional
+import wave
+from typing import Any, Iterator, List, Optional, Tuple
 
-import pyfiglet
+import numpy as np
 import torchaudio
 import torch
-from pyannote.audio import Pipeline
+from pyannote.audio import Audio, Pipeline
 from pyannote.audio.pipelines.utils.hook import ProgressHook
+from pyannote.core import Segment
 from pyannote.core.annotation import Annotation
 from rich.console import Console
 from rich.logging import RichHandler
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
 
 import whispernote.helpers.utils as utils
 
 MODULE_NAME = "diarize"
+MODEL_NAME = "pyannote/speaker-diarization"
+# sample rate the pyannote segmentation and embedding models run at
+SAMPLE_RATE = 16000
+# max cosine distance between the embeddings of a speaker in different windows
+SPEAKER_MATCH_THRESHOLD = 0.7
+# overlap between consecutive windows of long audio, in seconds
+WINDOW_OVERLAP = 30.0
 
 logger = logging.getLogger(MODULE_NAME)
-logargs = {
-    "level": logging.INFO,
-    # "format": "%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s",
-    "format": "%(message)s",
-    "handlers": [RichHandler(rich_tracebacks=True)],
-}
-logging.basicConfig(**logargs)
-
-console = Console()
 
 pipeline: Pipeline = None  # type: ignore
+device: torch.device = None  # type: ignore
 
 
-def load_model(hugging_face_key: str, threads: int = 8) -> None:
+class AutocastEmbedding:
     """
-    Loads model to memory. Sends model to GPU if available, falls back to CPU if not.
+    Runs the pipeline's speaker embedding model under CUDA autocast.
+
+    Wraps the pipeline's `_embedding` and forwards every other attribute to it.
+    The embeddings are handed back to the clustering in float32.
+    """
+
+    def __init__(self, embedding: Any, dtype: torch.dtype = torch.float16):
+        self.embedding = embedding
+        self.dtype = dtype
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "embedding":  # not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.embedding, name)
+
+    def __call__(self, *args, **kwargs) -> np.ndarray:
+        with torch.autocast(device_type="cuda", dtype=self.dtype):
+            embeddings = self.embedding(*args, **kwargs)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+@functools.lru_cache(maxsize=4)
+def _build_pipeline(
+    model_name: str, device_name: str, hugging_face_key: str
+) -> Pipeline:
+    """
+    Loads a pipeline from HuggingFace and sends it to the device. Cached, so the
+    weights are downloaded, deserialized and copied to the device only once per
+    process.
 
     Args:
+        model_name (str): name of the pipeline on HuggingFace
+        device_name (str): device to send the pipeline to, e.g. "cuda:0"
         hugging_face_key (str): HuggingFace API key
-        threads (int): number of threads to use
 
     Returns:
-        None
+        Pipeline: the loaded pipeline
     """
-    global pipeline  # pylint: disable=global-statement
-    logger.info("Loading speaker diarization model from HuggingFace")
-    pipeline = Pipeline.from_pretrained(
-        "pyannote/speaker-diarization", use_auth_token=hugging_face_key
-    )
+    logger.info(f"Loading speaker diarization model {model_name} from HuggingFace")
+    loaded = Pipeline.from_pretrained(model_name, use_auth_token=hugging_face_key)
+    loaded.to(torch.device(device_name))
+    return loaded
+
+
+def select_device(threads: int = 8) -> torch.device:
+    """
+    Selects the device to run the pipeline on: the GPU with the most free memory if
+    available, the CPU if not. Selected on the first call only, later calls return
+    the same device.
+
+    Args:
+        threads (int): number of threads to use, when running on CPU
+
+    Returns:
+        torch.device: the device to run on
+    """
+    global device  # pylint: disable=global-statement
+    if device is not None:
+        return device
+
     # send pipeline to GPU (when available)
     if torch.cuda.is_available():
         gpu_idx = utils.get_free_gpu_idx()
@@ -77,7 +119,326 @@ def load_model(hugging_face_key: str, threads: int = 8) -> None:
         logger.info("Sending pipeline to CPU")
         torch.set_num_threads(threads)
 
-    pipeline.to(device)
+    return device
+
+
+def load_model(
+    hugging_face_key: str,
+    threads: int = 8,
+    embedding_batch_size: int = 8,
+    segmentation_batch_size: int = 8,
+    embedding_precision: torch.dtype = torch.float16,
+) -> None:
+    """
+    Loads model to memory. Sends model to GPU if available, falls back to CPU if not.
+    A pipeline already loaded on the same device is reused.
+
+    The pipeline ships with an embedding batch size of 32, which on GPUs with
+    12 GB or less of memory is much slower than smaller batches.
+
+    Args:
+        hugging_face_key (str): HuggingFace API key
+        threads (int): number of threads to use
+        embedding_batch_size (int): batch size of the speaker embedding model
+        segmentation_batch_size (int): batch size of the segmentation model
+        embedding_precision (torch.dtype): precision of the speaker embedding
+            model on GPU, float16 runs it on the tensor cores
+
+    Returns:
+        None
+    """
+    global pipeline  # pylint: disable=global-statement
+    pipeline = _build_pipeline(
+        MODEL_NAME, str(select_device(threads)), hugging_face_key
+    )
+    pipeline.embedding_batch_size = embedding_batch_size
+    pipeline.segmentation_batch_size = segmentation_batch_size
+
+    # The embedding model takes most of the diarization time
+    embedding = pipeline._embedding  # pylint: disable=protected-access
+    if isinstance(embedding, AutocastEmbedding):
+        embedding = embedding.embedding
+    if device.type == "cuda" and embedding_precision != torch.float32:
+        logger.info(f"Running speaker embedding model in {embedding_precision}")
+        embedding = AutocastEmbedding(embedding, embedding_precision)
+    pipeline._embedding = embedding  # pylint: disable=protected-access
+
+
+@contextlib.contextmanager
+def memory_pool() -> Iterator[None]:
+    """
+    Runs the enclosed CUDA allocations from a dedicated memory pool, which is
+    released once the block exits. The pipeline's chunks of varying sizes then do
+    not fragment the main cache. A no-op on CPU, or on torch builds without
+    memory pools.
+
+    Returns:
+        Iterator[None]: context manager
+    """
+    if device is None or device.type != "cuda" or not hasattr(torch.cuda, "MemPool"):
+        yield
+        return
+
+    pool = torch.cuda.MemPool()
+    try:
+        with torch.cuda.use_mem_pool(pool, device=device):
+            yield
+    finally:
+        del pool
+        torch.cuda.empty_cache()
+
+
+# numpy dtype and full scale of the integer PCM sample widths, by width in bytes
+PCM_FORMATS = {
+    1: (np.dtype("u1"), 128.0),
+    2: (np.dtype("<i2"), 32768.0),
+    4: (np.dtype("<i4"), 2.0**31),
+}
+
+
+def read_pcm_wav(audio_path: str) -> Optional[Tuple[torch.Tensor, int]]:
+    """
+    Reads an integer PCM WAV file straight into a mono waveform, skipping FFmpeg.
+    The samples are scaled to [-1, 1) and the channels averaged, as torchaudio and
+    pyannote do.
+
+    Args:
+        audio_path (str): path to WAV file
+
+    Returns:
+        Optional[Tuple[torch.Tensor, int]]: (1, num_samples) waveform and its sample
+            rate. None if the file is not a PCM WAV file this can read.
+    """
+    try:
+        with wave.open(audio_path, "rb") as wav_file:
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            sample_rate = wav_file.getframerate()
+            frames = wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if sample_width not in PCM_FORMATS:
+        return None
+
+    dtype, full_scale = PCM_FORMATS[sample_width]
+    samples = np.frombuffer(frames, dtype=dtype).reshape(-1, channels)
+    samples = samples.mean(axis=1, dtype=np.float32)
+    if sample_width == 1:  # 8-bit WAV is unsigned
+        samples -= 128.0
+    samples /= full_scale
+
+    return torch.from_numpy(samples[np.newaxis]), sample_rate
+
+
+def decode_audio(audio_path: str) -> Tuple[torch.Tensor, int]:
+    """
+    Decodes audio file to a mono waveform, on the CPU. The decoder releases the
+    GIL, so `diarize` runs this in the background while the model loads.
+
+    Args:
+        audio_path (str): path to audio file
+
+    Returns:
+        Tuple[torch.Tensor, int]: (1, num_samples) waveform and its sample rate
+    """
+    if Path(audio_path).suffix.lower() == ".wav":
+        decoded = read_pcm_wav(audio_path)
+        if decoded is not None:
+            return decoded
+        logger.debug(f"{audio_path} is not an integer PCM WAV file, using FFmpeg")
+
+    return Audio(mono="downmix")(audio_path)
+
+
+def load_audio(waveform: torch.Tensor, sample_rate: int) -> torch.Tensor:
+    """
+    Moves a decoded waveform to the pipeline's device and resamples it to
+    SAMPLE_RATE.
+
+    The audio is decoded once and resampled on the GPU (when available), so the
+    pipeline crops chunks from memory instead of re-reading and resampling the
+    file on the CPU for every chunk.
+
+    Args:
+        waveform (torch.Tensor): (1, num_samples) waveform, from `decode_audio`
+        sample_rate (int): sample rate of the waveform
+
+    Returns:
+        torch.Tensor: (1, num_samples) waveform at SAMPLE_RATE
+    """
+    waveform = waveform.to(device, non_blocking=True)
+    if sample_rate != SAMPLE_RATE:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, SAMPLE_RATE)
+    return waveform
+
+
+def match_speakers(
+    embeddings: np.ndarray,
+    centroids: List[np.ndarray],
+    max_speakers: Optional[int] = None,
+) -> List[int]:
+    """
+    Maps the speakers of a window to the speakers found so far, by the cosine
+    distance of their embeddings. Speakers with no match within
+    SPEAKER_MATCH_THRESHOLD are added as new speakers, unless `max_speakers` are
+    known already, in which case they go to the closest one.
+
+    Args:
+        embeddings (np.ndarray): (num_window_speakers, dimension) speaker embeddings
+            of the window, NaN for speakers without one
+        centroids (List[np.ndarray]): sum of the normalized embeddings of each
+            speaker found so far, updated in place
+        max_speakers (int): maximum number of speakers, if known
+
+    Returns:
+        List[int]: index in `centroids` of each speaker of the window
+    """
+    num_known = len(centroids)
+    speaker_idxs = [-1] * len(embeddings)
+    distances = np.full((len(embeddings), max(num_known, 1)), 2.0)
+    if num_known:
+        distances = np.nan_to_num(
+            cdist(embeddings, np.stack(centroids), metric="cosine"), nan=2.0
+        )
+        for row, col in zip(*linear_sum_assignment(distances)):
+            if distances[row, col] < SPEAKER_MATCH_THRESHOLD:
+                speaker_idxs[row] = int(col)
+
+    for row, embedding in enumerate(embeddings):
+        if speaker_idxs[row] == -1:
+            if num_known and max_speakers and len(centroids) >= max_speakers:
+                speaker_idxs[row] = int(np.argmin(distances[row]))
+            else:
+                centroids.append(np.zeros_like(embedding))
+                speaker_idxs[row] = len(centroids) - 1
+
+        norm = np.linalg.norm(embedding)
+        if np.isfinite(norm) and norm > 0:
+            centroids[speaker_idxs[row]] += embedding / norm
+
+    return speaker_idxs
+
+
+def check_window(window: float, overlap: float) -> None:
+    """
+    Checks that consecutive windows advance, i.e. the window is longer than the
+    overlap, unless windowing is disabled.
+
+    Args:
+        window (float): window length, in seconds. 0 disables windowing
+        overlap (float): overlap between consecutive windows, in seconds
+
+    Raises:
+        ValueError: If the window is negative, or not longer than the overlap.
+    """
+    if window < 0 or 0 < window <= overlap:
+        raise ValueError(
+            f"Window ({window}s) must be 0, or longer than the overlap ({overlap}s)"
+        )
+
+
+def window_bounds(
+    num_samples: int, window: float, overlap: float
+) -> List[Tuple[int, float, float]]:
+    """
+    Splits a waveform into overlapping windows. The last window starts before the
+    end of the waveform, and each window keeps its speaker turns up to the middle
+    of its overlaps with the neighbouring windows.
+
+    Args:
+        num_samples (int): length of the waveform, in samples at SAMPLE_RATE
+        window (float): window length, in seconds
+        overlap (float): overlap between consecutive windows, in seconds
+
+    Returns:
+        List[Tuple[int, float, float]]: first sample of each window, and start and
+            end of the region it keeps, in seconds from the start of the window
+
+    Raises:
+        ValueError: If the window is not longer than the overlap.
+    """
+    if window <= max(overlap, 0):
+        raise ValueError(
+            f"Window ({window}s) must be longer than the overlap ({overlap}s)"
+        )
+
+    window_samples = int(window * SAMPLE_RATE)
+    step_samples = int((window - overlap) * SAMPLE_RATE)
+    starts = [0]
+    while starts[-1] + window_samples < num_samples:
+        starts.append(starts[-1] + step_samples)
+
+    return [
+        (
+            start,
+            overlap / 2 if idx > 0 else 0.0,
+            window - overlap / 2 if idx < len(starts) - 1 else window,
+        )
+        for idx, start in enumerate(starts)
+    ]
+
+
+def diarize_windows(
+    waveform: torch.Tensor,
+    window: float,
+    overlap: float,
+    max_speakers: Optional[int] = None,
+    hook: Optional[ProgressHook] = None,
+) -> Annotation:
+    """
+    Diarizes a long waveform in overlapping windows, so the memory used by the
+    pipeline is bounded by the window length instead of the audio length.
+
+    Each window keeps the speaker turns up to the middle of its overlaps with
+    the neighbouring windows. Speakers are matched across windows by their
+    embeddings, and turns split at window boundaries are merged back.
+
+    Args:
+        waveform (torch.Tensor): (1, num_samples) waveform at SAMPLE_RATE
+        window (float): window length, in seconds
+        overlap (float): overlap between consecutive windows, in seconds
+        max_speakers (int): maximum number of speakers, if known
+        hook (ProgressHook): progress hook passed on to the pipeline
+
+    Returns:
+        pyannote.core.Annotation: result of diarization
+
+    Raises:
+        ValueError: If the window is not longer than the overlap.
+    """
+    window_samples = int(window * SAMPLE_RATE)
+    bounds = window_bounds(waveform.shape[1], window, overlap)
+
+    diarization = Annotation()
+    centroids: List[np.ndarray] = []
+    for idx, (start, keep_start, keep_end) in enumerate(bounds):
+        logger.info(f"Diarizing window {idx + 1} of {len(bounds)}")
+        chunk = {
+            "waveform": waveform[:, start : start + window_samples],
+            "sample_rate": SAMPLE_RATE,
+        }
+        window_diarization, embeddings = pipeline(
+            chunk, hook=hook, max_speakers=max_speakers, return_embeddings=True
+        )
+
+        # the pipeline may return fewer embeddings than speakers
+        labels = window_diarization.labels()
+        window_embeddings = np.full((len(labels), embeddings.shape[1]), np.nan)
+        window_embeddings[: len(embeddings)] = embeddings[: len(labels)]
+        speaker_idxs = match_speakers(window_embeddings, centroids, max_speakers)
+        speakers = {
+            label: f"SPEAKER_{speaker_idx:02d}"
+            for label, speaker_idx in zip(labels, speaker_idxs)
+        }
+
+        offset = start / SAMPLE_RATE
+        for segment, track, label in window_diarization.crop(
+            Segment(keep_start, keep_end)
+        ).itertracks(yield_label=True):
+            shifted = Segment(segment.start + offset, segment.end + offset)
+            diarization[shifted, f"{track}{idx}"] = speakers[label]
+
+    return diarization.support()
 
 
 def diarize(
@@ -87,11 +448,19 @@ def diarize(
     min_speakers: Optional[int] = None,
     max_speakers: Optional[int] = None,
     threads: int = 8,
+    embedding_batch_size: int = 8,
+    segmentation_batch_size: int = 8,
+    embedding_precision: torch.dtype = torch.float16,
+    window: float = 600.0,
+    window_overlap: float = WINDOW_OVERLAP,
 ) -> Annotation:
     """
     Diarize audio file. Returns result of diarization as Annotation object,
     use write_output to write to file.
 
+    Audio longer than `window` is diarized in overlapping windows, as the memory
+    used by the pipeline grows with the audio length.
+
     Args:
         audio_path (str): path to audio file
         hugging_face_key (str): HuggingFace API key
@@ -99,43 +468,162 @@ def diarize(
         min_speakers (int): minimum number of speakers, if known
         max_speakers (int): maximum number of speakers, if known
         threads (int): number of threads to use
+        embedding_batch_size (int): batch size of the speaker embedding model
+        segmentation_batch_size (int): batch size of the segmentation model
+        embedding_precision (torch.dtype): precision of the speaker embedding
+            model on GPU, use torch.float32 for reproducible results
+        window (float): length of the windows, in seconds. 0 diarizes the whole
+            file at once
+        window_overlap (float): overlap between consecutive windows, in seconds
 
     Returns:
         pyannote.core.Annotation: result of diarization
+
+    Raises:
+        ValueError: If the window is negative, or not longer than the overlap.
     """
-    if pipeline is None:
-        load_model(hugging_face_key, threads)
+    check_window(window, window_overlap)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        logger.info("Loading audio file")
+        decode_task = executor.submit(decode_audio, audio_path)
+
+        # Cheap once the pipeline is loaded, and applies this call's batch sizes
+        # and embedding precision to the cached pipeline
+        load_model(
+            hugging_face_key,
+            threads,
+            embedding_batch_size,
+            segmentation_batch_size,
+            embedding_precision,
+        )
 
-    logger.info("Loading audio file")
-    waveform, sample_rate = torchaudio.load(audio_path)  # type: ignore
+        waveform, sample_rate = decode_task.result()
+
+    audio = {"waveform": load_audio(waveform, sample_rate), "sample_rate": SAMPLE_RATE}
 
     logger.info("Diarizing audio file")
-    with ProgressHook() as hook:
-        if speaker_count:
+    with memory_pool(), ProgressHook() as hook:
+        if window and audio["waveform"].shape[1] > window * SAMPLE_RATE:
+            logger.debug(f"Diarizing in {window}s windows, {window_overlap}s overlap")
+            diarization = diarize_windows(
+                audio["waveform"],
+                window,
+                window_overlap,
+                max_speakers=speaker_count or max_speakers,
+                hook=hook,
+            )
+        elif speaker_count:
             logger.debug(f"Speaker count: {speaker_count}")
             diarization: Annotation = pipeline(
-                {"waveform": waveform, "sample_rate": sample_rate},
+                audio,
                 hook=hook,
                 num_speakers=speaker_count,
             )
         elif min_speakers and max_speakers:
             logger.debug(f"Speaker count range: {min_speakers} - {max_speakers}")
             diarization = pipeline(
-                {"waveform": waveform, "sample_rate": sample_rate},
+                audio,
                 hook=hook,
                 min_speakers=min_speakers,
                 max_speakers=max_speakers,
             )
         else:
             logger.debug("No speaker count or speaker count range specified")
-            diarization: Annotation = pipeline(
-                {"waveform": waveform, "sample_rate": sample_rate}, hook=hook
-            )
+            diarization: Annotation = pipeline(audio, hook=hook)
 
     logger.info("Diarization complete")
     return diarization
 
 
+def diarize_many(
+    audio_paths: List[str],
+    hugging_face_key: str,
+    speaker_count: Optional[int] = None,
+    min_speakers: Optional[int] = None,
+    max_speakers: Optional[int] = None,
+    threads: int = 8,
+    embedding_batch_size: int = 8,
+    segmentation_batch_size: int = 8,
+    embedding_precision: torch.dtype = torch.float16,
+    window: float = 600.0,
+    window_overlap: float = WINDOW_OVERLAP,
+) -> List[Annotation]:
+    """
+    Diarize several audio files, loading the model only once.
+
+    Args:
+        audio_paths (List[str]): paths to audio files
+        hugging_face_key (str): HuggingFace API key
+        speaker_count (int): number of speakers, if known
+        min_speakers (int): minimum number of speakers, if known
+        max_speakers (int): maximum number of speakers, if known
+        threads (int): number of threads to use
+        embedding_batch_size (int): batch size of the speaker embedding model
+        segmentation_batch_size (int): batch size of the segmentation model
+        embedding_precision (torch.dtype): precision of the speaker embedding
+            model on GPU
+        window (float): length of the windows long audio is diarized in, in
+            seconds. 0 diarizes each file at once
+        window_overlap (float): overlap between consecutive windows, in seconds
+
+    Returns:
+        List[pyannote.core.Annotation]: result of diarization, one per file
+    """
+    load_model(
+        hugging_face_key,
+        threads,
+        embedding_batch_size,
+        segmentation_batch_size,
+        embedding_precision,
+    )
+
+    diarizations: List[Annotation] = []
+    for idx, audio_path in enumerate(audio_paths, start=1):
+        logger.info(f"Diarizing file {idx} of {len(audio_paths)}: {audio_path}")
+        diarizations.append(
+            diarize(
+                audio_path,
+                hugging_face_key,
+                speaker_count=speaker_count,
+                min_speakers=min_speakers,
+                max_speakers=max_speakers,
+                threads=threads,
+                embedding_batch_size=embedding_batch_size,
+                segmentation_batch_size=segmentation_batch_size,
+                embedding_precision=embedding_precision,
+                window=window,
+                window_overlap=window_overlap,
+            )
+        )
+
+    return diarizations
+
+
+def to_arrays(diarization: Annotation) -> Tuple[np.ndarray, List[str]]:
+    """
+    Converts the speaker turns of a diarization to a (N, 2) array of start and end
+    times in milliseconds, and the list of their speakers.
+
+    Args:
+        diarization (pyannote.core.Annotation): result of diarization
+
+    Returns:
+        Tuple[np.ndarray, List[str]]: int64 (start_ms, end_ms) per turn, and the
+            speaker of each turn
+    """
+    turns = list(diarization.itertracks(yield_label=True))  # type: ignore
+    times = np.fromiter(
+        (time for segment, _, _ in turns for time in (segment.start, segment.end)),
+        dtype=np.float64,
+        count=2 * len(turns),
+    ).reshape(-1, 2)
+    speakers = [speaker for _, _, speaker in turns]
+
+    # truncated, like int(seconds * 1000)
+    return (times * 1000).astype(np.int64), speakers
+
+
 def write_output(output: str, diarization: Annotation) -> None:
     """Write output to file
 
@@ -146,21 +634,28 @@ def write_output(output: str, diarization: Annotation) -> None:
     Returns:
         None
     """
-    with open(output, "w", encoding="utf-8") as text_file:
-        for segment, _, label in diarization.itertracks(yield_label=True):  # type: ignore
-            speaker = label
-            start, end, _ = segment.start, segment.end, segment.duration
+    times_ms, speakers = to_arrays(diarization)
+    lines = map(
+        "%d,%d,%s\n".__mod__,
+        zip(times_ms[:, 0].tolist(), times_ms[:, 1].tolist(), speakers),
+    )
+
+    Path(output).write_text("".join(lines), encoding="utf-8")
 
-            start_ms = int(start * 1000)
-            end_ms = int(end * 1000)
 
-            text_file.write(f"{start_ms},{end_ms},{speaker}\n")
+def get_huggingface_key(params: Optional[dict] = None) -> str:
+    """Get HuggingFace API key from config file
 
+    Args:
+        params (dict, optional): already parsed "whispernote" config section.
+            Read from the config file if not provided.
 
-def get_huggingface_key():
-    """Get HuggingFace API key from config file"""
-    config_path = utils.get_config_file()
-    params = utils.config(config_path, section="whispernote")
+    Returns:
+        str: HuggingFace API key
+    """
+    if params is None:
+        config_path = utils.get_config_file()
+        params = utils.config(config_path, section="whispernote")
 
     if "huggingface_api_key_file" not in params:
         logger.error("HuggingFace API key file not found in config file")
@@ -169,8 +664,7 @@ def get_huggingface_key():
     hugging_face_key_file = params["huggingface_api_key_file"]
     logger.debug(f"HuggingFace API key file: {hugging_face_key_file}")
 
-    with open(hugging_face_key_file, "r", encoding="utf-8") as key_file:
-        hugging_face_key = key_file.read().strip()
+    hugging_face_key = Path(hugging_face_key_file).read_text(encoding="utf-8").strip()
 
     return hugging_face_key
 
@@ -179,6 +673,19 @@ def main() -> None:
     """
     Diarize audio file
     """
+    # Only configure logging and the console when run as a script, not on import
+    logargs = {
+        "level": logging.INFO,
+        # "format": "%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s",
+        "format": "%(message)s",
+        "handlers": [RichHandler(rich_tracebacks=True)],
+    }
+    logging.basicConfig(**logargs)
+
+    utils.set_cuda_alloc_conf()
+
+    console = Console()
+
     parser = argparse.ArgumentParser(description="Diarize audio file")
 
     parser.add_argument("--input", type=str, help="input audio file", required=True)
@@ -198,6 +705,31 @@ def main() -> None:
         help="maximum number of speakers, if known",
         required=False,
     )
+    parser.add_argument(
+        "--embedding-batch-size",
+        type=int,
+        help="batch size of the speaker embedding model",
+        default=8,
+    )
+    parser.add_argument(
+        "--segmentation-batch-size",
+        type=int,
+        help="batch size of the segmentation model",
+        default=8,
+    )
+    parser.add_argument(
+        "--embedding-precision",
+        type=str,
+        help="precision of the speaker embedding model on GPU",
+        choices=["float16", "bfloat16", "float32"],
+        default="float16",
+    )
+    parser.add_argument(
+        "--window",
+        type=float,
+        help="diarize audio longer than this in windows of this many seconds, 0 to disable",
+        default=600.0,
+    )
     parser.add_argument(
         "--log-file",
         type=str,
@@ -207,6 +739,11 @@ def main() -> None:
 
     args = parser.parse_args()
 
+    try:
+        check_window(args.window, WINDOW_OVERLAP)
+    except ValueError as e:
+        parser.error(f"--window: {e}")
+
     if args.log_file:
         file_handler = logging.FileHandler(args.log_file, mode="a")
         file_handler.setLevel(logging.DEBUG)
@@ -215,8 +752,7 @@ def main() -> None:
         )
         logging.getLogger().addHandler(file_handler)
 
-    title = pyfiglet.figlet_format("WhisperNote", font="slant")
-    console.print(f"[bold red]{title}")
+    console.print(f"[bold red]{utils.BANNER}")
     console.rule("[bold red]Diarization")
 
     has_speaker_count = args.speaker_count is not None
@@ -243,6 +779,10 @@ def main() -> None:
         speaker_count=args.speaker_count,
         min_speakers=args.min_speakers,
         max_speakers=args.max_speakers,
+        embedding_batch_size=args.embedding_batch_size,
+        segmentation_batch_size=args.segmentation_batch_size,
+        embedding_precision=getattr(torch, args.embedding_precision),
+        window=args.window,
     )
 
     logger.info("Writing output to file")
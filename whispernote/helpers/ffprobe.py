@@ -70,17 +70,16 @@ def ffprobe(file_path: Path) -> FFProbeResult:
         "json",
         "-show_format",
         "-show_streams",
-        f"'{file_path}'",
+        str(file_path),
     ]
 
     logger.debug(f"Running ffprobe command: {' '.join(command_array)}")
 
     result = subprocess.run(
-        " ".join(command_array),
+        command_array,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         universal_newlines=True,
-        shell=True,
         check=False,
     )
 
@@ -3,41 +3,80 @@ Contains utility functions used by the WhisperNote package.
 """
 
 from configparser import ConfigParser
+import fcntl
+import importlib.metadata
 import subprocess
 import os
-import sys
 import logging
+import functools
+from typing import Dict, List, Optional, TextIO, Tuple
+
+try:
+    import pynvml
+except ImportError:  # fall back to nvidia-smi
+    pynvml = None
 
 BLACKLISTED_GPU_IDS = []
 
+# Lock files of the GPUs claimed by this process, held until it exits
+_gpu_locks: Dict[int, TextIO] = {}
+
+# Pre-rendered `pyfiglet.figlet_format("WhisperNote", font="slant")`
+BANNER = (
+    " _       ____    _                      _   __      __     \n"
+    "| |     / / /_  (_)________  ___  _____/ | / /___  / /____ \n"
+    "| | /| / / __ \\/ / ___/ __ \\/ _ \\/ ___/  |/ / __ \\/ __/ _ \\\n"
+    "| |/ |/ / / / / (__  ) /_/ /  __/ /  / /|  / /_/ / /_/  __/\n"
+    "|__/|__/_/ /_/_/____/ .___/\\___/_/  /_/ |_/\\____/\\__/\\___/ \n"
+    "                   /_/                                     \n"
+)
+
 
-def config(filename: str, section: str) -> dict:
+@functools.lru_cache(maxsize=16)
+def _read_config(filename: str) -> Dict[str, Dict[str, str]]:
     """
-    Read the configuration file and return a dictionary of the configuration parameters.
+    Parses the configuration file. Cached, as the configuration does not change
+    while WhisperNote runs.
 
     Args:
         filename (str): The name of the configuration file.
-        section (str): The section of the configuration file to read.
 
     Returns:
-        dict: A dictionary of the configuration parameters.
+        Dict[str, Dict[str, str]]: The configuration parameters, by section.
     """
     parser = ConfigParser()
     parser.read(filename)
 
-    conf = {}
-    if parser.has_section(section):
-        params = parser.items(section)
-        for param in params:
-            conf[param[0]] = param[1]
-    else:
+    return {name: dict(parser.items(name)) for name in parser.sections()}
+
+
+def config(filename: str, section: Optional[str] = None) -> dict:
+    """
+    Read the configuration file and return a dictionary of the configuration parameters.
+
+    Args:
+        filename (str): The name of the configuration file.
+        section (str, optional): The section of the configuration file to read.
+            If omitted, all sections are returned, keyed by section name.
+
+    Returns:
+        dict: A dictionary of the configuration parameters.
+    """
+    sections = _read_config(filename)
+
+    # Copies, so callers cannot modify the cached configuration
+    if section is None:
+        return {name: dict(params) for name, params in sections.items()}
+
+    if section not in sections:
         raise ValueError(
             f"Section {section} not found in the {filename} file"
         )
 
-    return conf
+    return dict(sections[section])
 
 
+@functools.lru_cache(maxsize=1)
 def get_repo_root() -> str:
     """
     Returns the root directory of the current Git repository.
@@ -49,6 +88,7 @@ def get_repo_root() -> str:
     return repo_root
 
 
+@functools.lru_cache(maxsize=1)
 def get_config_file() -> str:
     """
     Returns the path to the config file.
@@ -60,6 +100,23 @@ def get_config_file() -> str:
     return config_file
 
 
+@functools.lru_cache(maxsize=None)
+def nvml_available() -> bool:
+    """
+    Initializes NVML, once per process.
+
+    Returns:
+        bool: True if the NVML bindings are installed and the driver loaded.
+    """
+    if pynvml is None:
+        return False
+    try:
+        pynvml.nvmlInit()
+    except pynvml.NVMLError:
+        return False
+    return True
+
+
 def check_gpu(
     logger: logging.Logger = logging.getLogger(__name__),
 ) -> bool:
@@ -69,6 +126,12 @@ def check_gpu(
     Returns:
         bool: True if a GPU is available, False otherwise.
     """
+    if nvml_available():
+        if pynvml.nvmlDeviceGetCount() > 0:
+            return True
+        logger.info("NVIDIA GPU not detected")
+        return False
+
     # Check if NVIDIA GPU is available using nvidia-smi
     try:
         subprocess.check_output(["nvidia-smi"])
@@ -79,85 +142,248 @@ def check_gpu(
     return True
 
 
-def get_free_gpu_idx() -> int:
+def query_gpus() -> List[Tuple[int, int, int, int]]:
     """
-    Returns the index of the GPU with the most free memory.
-
-    Uses the nvidia-smi command to get the memory usage of each GPU and returns the
-    index of the GPU with the most free memory.
+    Queries the memory and utilization of each GPU, through NVML, or the nvidia-smi
+    command if NVML is not available. Indices are the ones reported by nvidia-smi
+    (PCI bus order).
 
     Returns:
-        str: The index of the GPU with the most free memory.
+        List[Tuple[int, int, int, int]]: (index, free memory in MiB, total memory in
+            MiB, utilization in %) of each GPU.
     """
+    if nvml_available():
+        gpus = []
+        for gpu_idx in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_idx)
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            utilization = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+            gpus.append((gpu_idx, memory.free >> 20, memory.total >> 20, utilization))
+        return gpus
+
     # Get the output of nvidia-smi command as a string
     output = subprocess.check_output(
-        ["nvidia-smi", "--query-gpu=memory.free,index", "--format=csv,nounits,noheader"]
+        [
+            "nvidia-smi",
+            "--query-gpu=index,memory.free,memory.total,utilization.gpu",
+            "--format=csv,nounits,noheader",
+        ]
     )
 
-    # Split the output by newline and sort by memory free in descending order
-    lines = output.decode().split("\n")
+    # Split the output by newline, and remove empty strings
+    lines = [line for line in output.decode().split("\n") if line]
+
+    gpus = []
+    for line in lines:
+        gpu_idx, free, total, utilization = line.split(",")
+        gpus.append((int(gpu_idx), int(free), int(total), int(utilization)))
+    return gpus
+
 
-    # Remove empty string
-    lines = [line for line in lines if line]
+def get_free_gpu_idxs(mem_required_mib: int = 0) -> List[int]:
+    """
+    Returns the indices of the usable GPUs, best candidate first.
+
+    GPUs are ranked by the fraction of their memory that is free minus the fraction
+    of time they are busy (utilization), so a GPU with free memory that is already
+    running another job ranks below an idle one. Ties go to the GPU with the most
+    free memory. Blacklisted GPUs, and GPUs with less than `mem_required_mib` of
+    free memory, are left out.
 
-    lines.sort(key=lambda x: int(x.split(",")[0]), reverse=True)
+    Args:
+        mem_required_mib (int, optional): Free memory (MiB) a GPU needs to be usable.
+            Defaults to 0.
 
-    # Get the index of the GPU with the most free memory
-    gpu_index = lines[0].split(",")[1]
+    Returns:
+        List[int]: The indices of the usable GPUs, best candidate first.
+    """
+    gpus = [
+        gpu
+        for gpu in query_gpus()
+        if gpu[0] not in BLACKLISTED_GPU_IDS and gpu[1] >= mem_required_mib
+    ]
 
-    # Check if GPU is blacklisted
-    if int(gpu_index) in BLACKLISTED_GPU_IDS:
-        gpu_index = lines[1].split(",")[1]
+    gpus.sort(key=_gpu_rank, reverse=True)
 
-    return int(gpu_index)
+    return [gpu[0] for gpu in gpus]
 
 
-def execute_commands(
-    command_array: list,
-    shell: bool = False,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
-    logger: logging.Logger = logging.getLogger(__name__),
-) -> subprocess.CompletedProcess:
+def _gpu_rank(gpu: Tuple[int, int, int, int]) -> Tuple[float, int]:
     """
-    Executes a command and returns the result.
+    Sort key of a GPU returned by `query_gpus`, see `get_free_gpu_idxs`.
 
     Args:
-        command_array (list): The command to execute as a list of strings.
-        shell (bool, optional): Whether to execute the command in a shell. Defaults to False.
+        gpu (Tuple[int, int, int, int]): (index, free memory in MiB, total memory
+            in MiB, utilization in %) of the GPU
 
     Returns:
-        subprocess.CompletedProcess: The result of the command execution.
+        Tuple[float, int]: free memory fraction minus utilization fraction, and free
+            memory. Higher is better.
+    """
+    return (gpu[1] / max(gpu[2], 1) - gpu[3] / 100, gpu[1])
 
-    Raises:
-        SystemExit: If the command fails, the function exits with status code 1.
 
+def _rank_visible_gpu_idxs(mem_required_mib: int) -> List[int]:
+    """
+    Returns the indices of the GPUs this process may use, best candidate first:
+    the GPUs with at least `mem_required_mib` of free memory, then the others,
+    each ranked like `get_free_gpu_idxs`. The GPUs are queried once.
+
+    Args:
+        mem_required_mib (int): Free memory (MiB) the GPU should have.
+
+    Returns:
+        List[int]: The GPU indices, as reported by nvidia-smi. Only those visible
+            through CUDA_VISIBLE_DEVICES, if it is set.
+    """
+    gpus = [gpu for gpu in query_gpus() if gpu[0] not in BLACKLISTED_GPU_IDS]
+    gpus.sort(
+        key=lambda gpu: (gpu[1] >= mem_required_mib, _gpu_rank(gpu)), reverse=True
+    )
+    gpu_idxs = [gpu[0] for gpu in gpus]
+
+    visible_gpu_idxs = get_visible_gpu_idxs()
+    if visible_gpu_idxs is None:
+        return gpu_idxs
+    return [gpu_idx for gpu_idx in gpu_idxs if gpu_idx in visible_gpu_idxs]
+
+
+def get_visible_gpu_idxs() -> Optional[List[int]]:
+    """
+    Returns the GPUs this process is restricted to by CUDA_VISIBLE_DEVICES.
+
+    Returns:
+        Optional[List[int]]: The visible GPU indices, in CUDA device order. None if
+            CUDA_VISIBLE_DEVICES is not set, or does not use plain indices.
+    """
+    visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if not visible_devices:
+        return None
+
+    devices = [device.strip() for device in visible_devices.split(",")]
+    if not all(device.isdigit() for device in devices):
+        return None
+
+    return [int(device) for device in devices]
+
+
+def get_free_gpu_idx(mem_required_mib: int = 4000) -> int:
+    """
+    Returns the index of the best GPU to run on.
+
+    Ranks the GPUs by free memory and utilization, like `get_free_gpu_idxs`, and
+    returns the best one with at least `mem_required_mib` of free memory. If none
+    has that much free memory, the best GPU overall is returned. If no GPU is
+    usable, 0 is returned.
+
+    If CUDA_VISIBLE_DEVICES restricts the process to some GPUs, only those are
+    considered, and the returned index is the CUDA device ordinal within this process.
+
+    Args:
+        mem_required_mib (int, optional): Free memory (MiB) the GPU should have.
+            Defaults to 4000.
+
+    Returns:
+        int: The index of the best GPU.
+    """
+    gpu_idxs = _rank_visible_gpu_idxs(mem_required_mib)
+    if not gpu_idxs:
+        return 0
+
+    visible_gpu_idxs = get_visible_gpu_idxs()
+    if visible_gpu_idxs is None:
+        return gpu_idxs[0]
+    return visible_gpu_idxs.index(gpu_idxs[0])
+
+
+def lock_free_gpu_idx(lock_dir: str, mem_required_mib: int = 4000) -> int:
+    """
+    Claims the best GPU that no other process has claimed, like `get_free_gpu_idx`.
+
+    Processes claim a GPU by locking its lock file, `<lock_dir>/gpu<index>.lock`,
+    until they exit, so that processes started together do not all pick the same
+    GPU. If every GPU is claimed, waits for the best one to be released.
+
+    Args:
+        lock_dir (str): Directory of the lock files, shared by the processes.
+        mem_required_mib (int, optional): Free memory (MiB) the GPU should have.
+            Defaults to 4000.
+
+    Returns:
+        int: The index of the claimed GPU, the CUDA device ordinal within this
+            process if CUDA_VISIBLE_DEVICES is set.
+    """
+    gpu_idxs = _rank_visible_gpu_idxs(mem_required_mib)
+    if not gpu_idxs:
+        return 0
+
+    os.makedirs(lock_dir, exist_ok=True)
+    # Every GPU is tried without waiting, then the best one again, waiting for it
+    attempts = [(gpu_idx, fcntl.LOCK_NB) for gpu_idx in gpu_idxs]
+    attempts.append((gpu_idxs[0], 0))
+    for gpu_idx, flags in attempts:
+        if gpu_idx in _gpu_locks:
+            break
+        lock_file = open(  # pylint: disable=consider-using-with
+            os.path.join(lock_dir, f"gpu{gpu_idx}.lock"), "w", encoding="utf-8"
+        )
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | flags)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        _gpu_locks[gpu_idx] = lock_file
+        break
+
+    visible_gpu_idxs = get_visible_gpu_idxs()
+    if visible_gpu_idxs is None:
+        return gpu_idx
+    return visible_gpu_idxs.index(gpu_idx)
+
+
+def set_cuda_alloc_conf() -> None:
     """
-    logger.info("\nExecuting command:")
-    logger.info(" ".join(command_array))
+    Tunes the CUDA caching allocator for diarization, whose chunks of varying sizes
+    fragment the cache. Leaves PYTORCH_CUDA_ALLOC_CONF alone if it is already set.
 
-    if shell:
-        result = subprocess.run(
-            " ".join(command_array),
-            stdout=stdout,
-            stderr=stderr,
-            shell=True,
-            check=False
+    The variable is read when CUDA is first used, so this must be called before, by
+    the entry points: it affects every later CUDA allocation of the process.
+    """
+    try:
+        torch_version = importlib.metadata.version("torch")
+    except importlib.metadata.PackageNotFoundError:
+        return
+
+    # expandable_segments is rejected by the allocator before torch 2.1
+    major, minor = (int(part) for part in torch_version.split(".")[:2])
+    if (major, minor) >= (2, 1):
+        os.environ.setdefault(
+            "PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:256"
         )
     else:
-        result = subprocess.run(command_array, stdout=stdout, stderr=stderr, check=False)
-
-    if result.returncode != 0:
-        logger.error("=====================================")
-        logger.error("Command: " + " ".join(command_array))
-        logger.error("=====================================")
-        logger.error("stdout:")
-        logger.error(result.stdout.decode("utf-8"))
-        logger.error("=====================================")
-        logger.error("stderr:")
-        logger.error(result.stderr.decode("utf-8"))
-        logger.error("=====================================")
-        logger.error("Exit code: " + str(result.returncode))
-        sys.exit(1)
-
-    return result
+        os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "max_split_size_mb:256")
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """
+    Parses a list of CPU cores in the format of taskset and /sys, e.g. "0-3,8,10-11".
+
+    Args:
+        cpu_list (str): comma separated cores, or ranges of cores
+
+    Returns:
+        List[int]: the cores, sorted
+
+    Raises:
+        ValueError: If the list is malformed.
+    """
+    cores = set()
+    for part in cpu_list.split(","):
+        first, _, last = part.strip().partition("-")
+        start = int(first)
+        end = int(last) if last else start
+        if end < start:
+            raise ValueError(f"Invalid range of CPU cores: {part}")
+        cores.update(range(start, end + 1))
+
+    return sorted(cores)
@@ -4,6 +4,11 @@ SubtitleElement class that represents a single subtitle element.
 from typing import Optional
 
 
+# Zero-padded renderings of 0-99 and 0-999, for the timestamp fields
+_PAD2 = tuple(f"{i:02d}" for i in range(100))
+_PAD3 = tuple(f"{i:03d}" for i in range(1000))
+
+
 def ms_to_HMSms(ms: float, delim: str = '.') -> str:
     """
     Converts milliseconds to HH:MM:SS<delim>MIL format.
@@ -15,15 +20,14 @@ def ms_to_HMSms(ms: float, delim: str = '.') -> str:
     Returns:
         str: The time in HH:MM:SS<delim>MIL format.
     """
-    s = ms / 1000
-
-    h = int(s // 3600)
-    m = int((s % 3600) // 60)
-    s = int(s % 60)
+    s, mil = divmod(int(ms), 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
 
-    mil = int((ms % 1000))
+    if h >= 100:
+        return f"{h:02d}:{m:02d}:{s:02d}{delim}{mil:03d}"
     # Format the timestamp as HH:MM:SS<delim>MIL
-    return f"{h:02d}:{m:02d}:{s:02d}{delim}{mil:03d}"
+    return _PAD2[h] + ":" + _PAD2[m] + ":" + _PAD2[s] + delim + _PAD3[mil]
 
 
 class SubtitleElement:
@@ -43,6 +47,10 @@ class SubtitleElement:
         transcript_string: Returns the string representation of the subtitle element in transcript
             format.
     """
+    __slots__ = (
+        "index", "start_ms", "end_ms", "text", "speaker", "_display_mode", "_render"
+    )
+
     def __init__(
         self,
         start_ms: int,
@@ -59,6 +67,22 @@ class SubtitleElement:
         self.speaker = speaker
         self.display_mode = display_mode
 
+    @property
+    def display_mode(self) -> str:
+        """
+        Current display mode of the subtitle element.
+
+        Returns:
+            str: The display mode of the subtitle element.
+        """
+        return self._display_mode
+
+    @display_mode.setter
+    def display_mode(self, value: str) -> None:
+        self._display_mode = value
+        # Resolve the renderer once, instead of on every __str__ call
+        self._render = _RENDERERS.get(value, SubtitleElement.srt_string)
+
     def srt_string(self) -> str:
         """
         Returns the string representation of the subtitle element in SRT format.
@@ -95,13 +119,13 @@ class SubtitleElement:
         return string_representation
 
     def __str__(self) -> str:
-        match self.display_mode:
-            case "srt":
-                return self.srt_string()
-            case "transcribeMe":
-                return self.transcript_string()
-            case _:
-                return self.srt_string()
+        return self._render(self)
 
     def __repr__(self) -> str:
         return self.__str__()
+
+
+_RENDERERS = {
+    "srt": SubtitleElement.srt_string,
+    "transcribeMe": SubtitleElement.transcript_string,
+}
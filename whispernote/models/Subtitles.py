@@ -1,29 +1,81 @@
 """
-Subtitles class, which contains a list of SubtitleElement objects.
+Subtitles class, which contains the subtitle elements of a transcript.
 """
-from typing import List
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numba
+import numpy as np
 
 from whispernote.models.SubtitleElement import SubtitleElement
 
+# Text ending with one of these ends a sentence
+STOP_CHARACTERS = (".", "?", "!")
+
+
+@numba.njit(cache=True)
+def _group_starts(
+    joinable: np.ndarray, word_counts: np.ndarray, max_words_per_line: int
+) -> np.ndarray:
+    """
+    Groups subtitle elements into lines. An element is joined to the line before it
+    if it may be joined with the previous element, and the line has fewer than
+    `max_words_per_line` words so far.
+
+    Args:
+        joinable (np.ndarray): Whether each element may be joined with the next one.
+        word_counts (np.ndarray): The number of words of each element.
+        max_words_per_line (int): Maximum number of words per line.
+
+    Returns:
+        np.ndarray: Whether each element starts a new line.
+    """
+    starts_line = np.ones(len(word_counts), dtype=np.bool_)
+    word_count = word_counts[0]
+    for idx in range(1, len(word_counts)):
+        if joinable[idx - 1] and word_count < max_words_per_line:
+            word_count += word_counts[idx]
+            starts_line[idx] = False
+        else:
+            word_count = word_counts[idx]
+    return starts_line
+
 
 class Subtitles:
     """
-    Subtitles class that contains a list of SubtitleElement objects.
+    Subtitles class that contains the subtitle elements of a transcript.
+
+    The elements are stored column-wise, one array per field, and SubtitleElement
+    objects are only built when the subtitles are rendered.
 
     Attributes:
         index (int): The index of the subtitle element.
         elements (List[SubtitleElement]): The list of subtitle elements.
+        indices (np.ndarray): The index of each subtitle element.
+        start_ms (np.ndarray): The start time of each subtitle element in milliseconds.
+        end_ms (np.ndarray): The end time of each subtitle element in milliseconds.
+        speakers (np.ndarray): The speaker of each subtitle element.
+        texts (List[str]): The text content of each subtitle element.
         display_mode (str): The display mode of the subtitles. Default is "srt".
 
     Methods:
         add_element: Adds a SubtitleElement to the list of subtitle elements.
+        add_elements: Adds subtitle elements from arrays of their fields.
+        joined: Returns new subtitles with adjacent subtitle elements joined, see
+            join_adjacent_elements.
         join_adjacent_elements: Joins adjacent subtitle elements with the same speaker if the first
             element doesn't end with a stop symbol.
         to_file: Writes the subtitles to a file in the specified display mode format.
     """
     def __init__(self, display_mode: str = "srt") -> None:
         self.index = 0
-        self.elements: List[SubtitleElement] = []
+        self._size = 0
+        # Allocated with spare capacity, grown by doubling as elements are added
+        self._indices = np.empty(0, dtype=np.int64)
+        self._start_ms = np.empty(0, dtype=np.int64)
+        self._end_ms = np.empty(0, dtype=np.int64)
+        self._speakers = np.empty(0, dtype=object)
+        self.texts: List[str] = []
         self._display_mode = display_mode
 
     @property
@@ -39,8 +91,86 @@ class Subtitles:
     @display_mode.setter
     def display_mode(self, value: str) -> None:
         self._display_mode = value
-        for element in self.elements:
-            element.display_mode = value
+
+    @property
+    def indices(self) -> np.ndarray:
+        """
+        The index of each subtitle element.
+
+        Returns:
+            np.ndarray: The indices of the subtitle elements.
+        """
+        return self._indices[: self._size]
+
+    @property
+    def start_ms(self) -> np.ndarray:
+        """
+        The start time of each subtitle element in milliseconds.
+
+        Returns:
+            np.ndarray: The start times of the subtitle elements.
+        """
+        return self._start_ms[: self._size]
+
+    @property
+    def end_ms(self) -> np.ndarray:
+        """
+        The end time of each subtitle element in milliseconds.
+
+        Returns:
+            np.ndarray: The end times of the subtitle elements.
+        """
+        return self._end_ms[: self._size]
+
+    @property
+    def speakers(self) -> np.ndarray:
+        """
+        The speaker of each subtitle element.
+
+        Returns:
+            np.ndarray: The speakers of the subtitle elements.
+        """
+        return self._speakers[: self._size]
+
+    @property
+    def elements(self) -> List[SubtitleElement]:
+        """
+        The subtitle elements, in the current display mode.
+
+        Returns:
+            List[SubtitleElement]: The list of subtitle elements.
+        """
+        return [
+            SubtitleElement(
+                start_ms=start_ms,
+                end_ms=end_ms,
+                text=text,
+                speaker=speaker,
+                index=index,
+                display_mode=self._display_mode,
+            )
+            for index, start_ms, end_ms, speaker, text in zip(
+                self.indices.tolist(),
+                self.start_ms.tolist(),
+                self.end_ms.tolist(),
+                self.speakers.tolist(),
+                self.texts,
+            )
+        ]
+
+    def _grow(self) -> None:
+        """
+        Doubles the capacity of the arrays.
+
+        Returns:
+            None
+        """
+        capacity = max(2 * len(self._start_ms), 64)
+        for name in ("_indices", "_start_ms", "_end_ms", "_speakers"):
+            array = getattr(self, name)
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[: self._size] = array[: self._size]
+            setattr(self, name, grown)
 
     def add_element(self, element: SubtitleElement) -> None:
         """
@@ -54,12 +184,131 @@ class Subtitles:
         """
         element.index = self.index
         self.index += 1
-        self.elements.append(element)
+
+        if self._size == len(self._start_ms):
+            self._grow()
+        self._indices[self._size] = element.index
+        self._start_ms[self._size] = element.start_ms
+        self._end_ms[self._size] = element.end_ms
+        self._speakers[self._size] = element.speaker
+        self.texts.append(element.text)
+        self._size += 1
+
+    def add_elements(
+        self,
+        start_ms: np.ndarray,
+        end_ms: np.ndarray,
+        texts: Sequence[str],
+        speakers: Sequence[str],
+    ) -> None:
+        """
+        Adds subtitle elements from their columns, as add_element would one by one.
+
+        Args:
+            start_ms (np.ndarray): The start time of each element in milliseconds.
+            end_ms (np.ndarray): The end time of each element in milliseconds.
+            texts (Sequence[str]): The text content of each element.
+            speakers (Sequence[str]): The speaker of each element.
+
+        Returns:
+            None
+        """
+        count = len(texts)
+        while self._size + count > len(self._start_ms):
+            self._grow()
+
+        added = slice(self._size, self._size + count)
+        self._indices[added] = np.arange(self.index, self.index + count)
+        self._start_ms[added] = start_ms
+        self._end_ms[added] = end_ms
+        self._speakers[added] = speakers
+        self.texts.extend(text.strip() for text in texts)
+
+        self.index += count
+        self._size += count
+
+    def _joined_columns(
+        self, max_words_per_line: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[str]]:
+        """
+        Computes the columns of the subtitles with adjacent elements joined, see
+        join_adjacent_elements.
+
+        Args:
+            max_words_per_line (int): Maximum number of words per line.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[str]]: The
+                indices, start times, end times, speakers and texts of the joined
+                elements.
+        """
+        if self._size == 0:
+            return (
+                self.indices.copy(),
+                self.start_ms.copy(),
+                self.end_ms.copy(),
+                self.speakers.copy(),
+                [],
+            )
+
+        # If speaker is the same, and the first element doesn't end with a stop symbol, join them
+        texts = self.texts
+        speakers = self.speakers
+        # Whether each element may be joined with the next, which only depends on
+        # the two: joined elements share the speaker and end like their last text
+        joinable = (speakers[:-1] == speakers[1:]) & ~np.fromiter(
+            (text.endswith(STOP_CHARACTERS) for text in texts[:-1]),
+            dtype=bool,
+            count=self._size - 1,
+        )
+
+        # The word limit depends on what was joined before, so group in one pass
+        word_counts = np.fromiter(
+            (text.count(" ") + 1 for text in texts), dtype=np.int64, count=self._size
+        )
+        starts = np.flatnonzero(_group_starts(joinable, word_counts, max_words_per_line))
+        ends = np.append(starts[1:], self._size)
+
+        joined_texts = [
+            " ".join(texts[start:end])
+            for start, end in zip(starts.tolist(), ends.tolist())
+        ]
+        return (
+            self.indices[starts],
+            self.start_ms[starts],
+            self.end_ms[ends - 1],
+            speakers[starts],
+            joined_texts,
+        )
+
+    def joined(self, max_words_per_line: int = 7) -> "Subtitles":
+        """
+        Returns new subtitles, with adjacent subtitle elements with the same speaker
+        joined if the first element doesn't end with a stop symbol. The subtitles
+        themselves are left unchanged.
+
+        Args:
+            max_words_per_line (int): Maximum number of words per line. Default is 7.
+
+        Returns:
+            Subtitles: The joined subtitles, in the same display mode.
+        """
+        subtitles = Subtitles(display_mode=self._display_mode)
+        subtitles.index = self.index
+        (
+            subtitles._indices,
+            subtitles._start_ms,
+            subtitles._end_ms,
+            subtitles._speakers,
+            subtitles.texts,
+        ) = self._joined_columns(max_words_per_line)
+        subtitles._size = len(subtitles.texts)
+        return subtitles
 
     def join_adjacent_elements(self, max_words_per_line: int = 7) -> None:
         """
         Joins adjacent subtitle elements with the same speaker if the first
-        element doesn't end with a stop symbol.
+        element doesn't end with a stop symbol, in place.
 
         Args:
             max_words_per_line (int): Maximum number of words per line. Default is 7.
@@ -67,30 +316,20 @@ class Subtitles:
         Returns:
             None
         """
-        # If speaker is the same, and the first element doesn't end with a stop symbol, join them
-        stop_characters = [".", "?", "!"]
-
-        idx = 0
-        while idx < len(self.elements) - 1:
-            element = self.elements[idx]
-            next_element = self.elements[idx + 1]
-
-            if (
-                element.speaker == next_element.speaker
-                and element.text[-1] not in stop_characters
-                and len(element.text.split(" ")) < max_words_per_line
-            ):
-                element.text = element.text.strip() + " " + next_element.text.strip()
-                element.end_ms = next_element.end_ms
-                self.elements.remove(next_element)
-            else:
-                idx += 1
+        (
+            self._indices,
+            self._start_ms,
+            self._end_ms,
+            self._speakers,
+            self.texts,
+        ) = self._joined_columns(max_words_per_line)
+        self._size = len(self.texts)
 
     def __str__(self) -> str:
-        string_representation = ""
-        for element in self.elements:
-            string_representation += str(element) + "\n"
-        return string_representation
+        lines = [str(element) for element in self.elements]
+        # Trailing empty line, so that every element is followed by a newline
+        lines.append("")
+        return "\n".join(lines)
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -105,15 +344,4 @@ class Subtitles:
         Returns:
             None
         """
-        match self.display_mode:
-            case "srt":
-                for element in self.elements:
-                    element.display_mode = "srt"
-            case "transcribeMe":
-                for element in self.elements:
-                    element.display_mode = "transcribeMe"
-            case _:
-                pass
-
-        with open(path, "w", encoding="utf-8") as text_file:
-            text_file.write(str(self))
+        Path(path).write_text(str(self), encoding="utf-8")
@@ -7,65 +7,74 @@ The Whisper JSON file is generated by `transcribe.py`.
 import sys
 from pathlib import Path
 
-file = Path(__file__).resolve()
-parent = file.parent
-ROOT = None
-for parent in file.parents:
-    if parent.name == "WhisperNote":
-        ROOT = parent
-sys.path.append(str(ROOT))
-
-# remove current directory from path
-try:
-    sys.path.remove(str(parent))
-except ValueError:
-    pass
+# When run as a script, make the `whispernote` package importable from the repo root
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
 import argparse
-import copy
 import json
-from io import StringIO
-from typing import Dict, Optional, List, Any
+import operator
+from typing import Dict, Optional, List, Any, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
-from whispernote.models.SubtitleElement import SubtitleElement
-from whispernote.models.Subtitles import Subtitles
+try:
+    import orjson
+except ImportError:  # fall back to the standard library parser
+    orjson = None
 
+from whispernote.models.Subtitles import STOP_CHARACTERS, Subtitles
 
-def process_whisper_transcript(whisper_json: str) -> str:
-    """
-    Converts a Whisper JSON file to a string containing the transcript in the format:
-    start_ms,end_ms,word
 
-    Args:
-        whisper_json (str): Path to the Whisper JSON file.
+WhisperJson = Union[str, Dict[str, Any]]
+"""Path to a Whisper JSON file, or the already loaded transcription result."""
 
-    Returns:
-        str: The transcript in the format: start_ms,end_ms,word
-    """
-    with open(whisper_json, encoding='utf-8') as json_file:
-        file_contents = json_file.read()
-        parsed_json = json.loads(file_contents)
+Diarization = Union[str, Path, Any]
+"""Path to a diarization CSV file, or a pyannote.core.Annotation."""
 
-    segments = parsed_json["segments"]
-    srt_file = StringIO()
 
-    for segment in segments:
-        start, end, _ = int(segment["start"]), int(segment["end"]), segment["text"]
+def process_whisper_transcript(whisper_json: WhisperJson) -> List[Tuple[int, int, str]]:
+    """
+    Converts a Whisper JSON file to a list of the words in the transcript, as:
+    (start_ms, end_ms, word)
 
-        words = segment["words"]
-        for word in words:
-            start, end, word = (word["start"]), (word["end"]), word["word"]
-            start_ms = int(start * 1000)
-            end_ms = int(end * 1000)
-            srt_file.write(f"{start_ms},{end_ms},{word}\n")
+    Args:
+        whisper_json (WhisperJson): Path to the Whisper JSON file, or the
+            transcription result itself.
 
-    return srt_file.getvalue()
+    Returns:
+        List[Tuple[int, int, str]]: The words of the transcript, as
+            (start_ms, end_ms, word)
+    """
+    if isinstance(whisper_json, dict):
+        parsed_json = whisper_json
+    else:
+        file_contents = Path(whisper_json).read_bytes()
+        if orjson is not None:
+            parsed_json = orjson.loads(file_contents)
+        else:
+            parsed_json = json.loads(file_contents)
+
+    get_word = operator.itemgetter("start", "end", "word")
+    words = [
+        get_word(word)
+        for segment in parsed_json["segments"]
+        for word in segment["words"]
+    ]
+    if not words:
+        return []
+
+    starts, ends, texts = zip(*words)
+    # Truncated to whole milliseconds, like int() would
+    start_ms = (np.array(starts, dtype=np.float64) * 1000).astype(np.int64)
+    end_ms = (np.array(ends, dtype=np.float64) * 1000).astype(np.int64)
+
+    return list(zip(start_ms.tolist(), end_ms.tolist(), texts))
 
 
 def get_transcript_df(
-    whisper_json_path: str,
+    whisper_json_path: WhisperJson,
 ) -> pd.DataFrame:
     """
     Converts a Whisper JSON file to a Pandas DataFrame containing the transcript.
@@ -76,14 +85,14 @@ def get_transcript_df(
     - text: The word.
 
     Args:
-        whisper_json_path (str): Path to the Whisper JSON file.
+        whisper_json_path (WhisperJson): Path to the Whisper JSON file, or the
+            transcription result itself.
 
     Returns:
         pd.DataFrame: The transcript as a Pandas DataFrame.
     """
-    transcript = process_whisper_transcript(whisper_json_path).strip().split("\n")
-    data = [line.split(",", maxsplit=2) for line in transcript]
-    transcript_df = pd.DataFrame(data, columns=["start", "end", "text"])
+    transcript = process_whisper_transcript(whisper_json_path)
+    transcript_df = pd.DataFrame(transcript, columns=["start", "end", "text"])
 
     transcript_df["start"] = transcript_df["start"].astype(int)
     transcript_df["end"] = transcript_df["end"].astype(int)
@@ -94,7 +103,7 @@ def get_transcript_df(
 
 
 def get_diarization_df(
-    diarization_path: str,
+    diarization_path: Diarization,
 ) -> pd.DataFrame:
     """
     Converts a diarization CSV file to a Pandas DataFrame containing the diarization.
@@ -103,65 +112,96 @@ def get_diarization_df(
     start,end,speaker
 
     Args:
-        diarization_path (str): Path to the diarization CSV file.
+        diarization_path (Diarization): Path to the diarization CSV file, or the
+            pyannote Annotation returned by `diarize.diarize`.
 
     Returns:
         pd.DataFrame: The diarization as a Pandas DataFrame.
     """
-    with open(diarization_path, encoding='utf-8') as file:
-        diarization = file.read().strip().split("\n")
+    if hasattr(diarization_path, "itertracks"):
+        # Only imported for an Annotation, which means pyannote is already loaded
+        from whispernote import diarize
 
-    data = [line.split(",") for line in diarization]
-    # If the diarization file has a header, remove it
-    if data[0][0] == "start":
-        data = data[1:]
-
-    diarization_df = pd.DataFrame(data, columns=["start", "end", "speaker"])
+        times_ms, speakers = diarize.to_arrays(diarization_path)
+        return pd.DataFrame(
+            {"start": times_ms[:, 0], "end": times_ms[:, 1], "speaker": speakers}
+        )
 
-    diarization_df["start"] = diarization_df["start"].astype(int)
-    diarization_df["end"] = diarization_df["end"].astype(int)
+    with open(diarization_path, encoding='utf-8') as file:
+        first_line = file.readline()
+
+    # Nothing was diarized
+    if not first_line.strip():
+        return pd.DataFrame(columns=["start", "end", "speaker"])
+
+    diarization_df = pd.read_csv(
+        diarization_path,
+        names=["start", "end", "speaker"],
+        # If the diarization file has a header, skip it
+        header=0 if first_line.startswith("start") else None,
+        dtype={"start": np.int64, "end": np.int64, "speaker": str},
+        keep_default_na=False,
+        encoding="utf-8",
+    )
 
     return diarization_df
 
 
 def merge_transcript_json(
-    whisper_json_path: str,
+    whisper_json_path: WhisperJson,
 ) -> Dict[str, Any]:
     """
     Merges adjacent words in a Whisper JSON file into segments.
 
     Args:
-        whisper_json_path (str): Path to the Whisper JSON file.
+        whisper_json_path (WhisperJson): Path to the Whisper JSON file, or the
+            transcription result itself.
 
     Returns:
         Dict[str, Any]: The merged Whisper JSON data.
     """
     df = get_transcript_df(whisper_json_path=whisper_json_path)
-    stop_characters = [".", "?", "!"]
-
-    groups = df.groupby(df["text"].shift().str[-1].isin(stop_characters).cumsum())
-    # groups = [group for _, group in groups]
 
     json_data: Dict[str, Any] = {}
     json_data["segments"] = []
-    for idx, group in groups:
-        group_json_data = {}
-        group_json_data["idx"] = idx
-        group_json_data["start"] = group["start"].min()
-        group_json_data["end"] = group["end"].max()
-        group_json_data["text"] = " ".join(group["text"].tolist())
-
-        group_json_data_parts = []
-        for part_idx, part in group.iterrows():
-            part_json_data = {}
-            part_json_data["idx"] = part_idx
-            part_json_data["start"] = part["start"]
-            part_json_data["end"] = part["end"]
-            part_json_data["text"] = part["text"]
+    if df.empty:
+        return json_data
+
+    start = df["start"].to_numpy()
+    end = df["end"].to_numpy()
+    text = df["text"].tolist()
+
+    # A new segment starts after every word that ends with a stop symbol
+    ends_segment = np.fromiter(
+        (word.endswith(STOP_CHARACTERS) for word in text[:-1]),
+        dtype=bool,
+        count=len(text) - 1,
+    )
+    boundaries = np.flatnonzero(ends_segment) + 1
+    group_starts = np.append(0, boundaries)
+    group_ends = np.append(boundaries, len(text))
 
-            group_json_data_parts.append(part_json_data)
+    group_start_ms = np.minimum.reduceat(start, group_starts).tolist()
+    group_end_ms = np.maximum.reduceat(end, group_starts).tolist()
+    start_ms = start.tolist()
+    end_ms = end.tolist()
 
-        group_json_data["parts"] = group_json_data_parts
+    group_bounds = zip(group_starts.tolist(), group_ends.tolist())
+    for idx, (first, last) in enumerate(group_bounds):
+        group_json_data = {}
+        group_json_data["idx"] = idx
+        group_json_data["start"] = group_start_ms[idx]
+        group_json_data["end"] = group_end_ms[idx]
+        group_json_data["text"] = " ".join(text[first:last])
+        group_json_data["parts"] = [
+            {
+                "idx": part_idx,
+                "start": start_ms[part_idx],
+                "end": end_ms[part_idx],
+                "text": text[part_idx],
+            }
+            for part_idx in range(first, last)
+        ]
         json_data["segments"].append(group_json_data)
 
     return json_data
@@ -195,13 +235,83 @@ def transcript_json_to_df(transcript_json: Dict[str, Any]) -> pd.DataFrame:
     return df
 
 
+def load_transcript_df(whisper_json_path: WhisperJson) -> pd.DataFrame:
+    """
+    Loads a Whisper JSON file as a DataFrame of sentence level segments, ready to be
+    combined with a diarization.
+
+    Args:
+        whisper_json_path (WhisperJson): Path to the Whisper JSON file, or the
+            transcription result itself.
+
+    Returns:
+        pd.DataFrame: The transcript as a Pandas DataFrame.
+    """
+    transcript_json = merge_transcript_json(whisper_json_path=whisper_json_path)
+    return transcript_json_to_df(transcript_json=transcript_json)
+
+
+def match_speaker_turns(
+    start: np.ndarray,
+    end: np.ndarray,
+    turn_start: np.ndarray,
+    turn_end: np.ndarray,
+) -> np.ndarray:
+    """
+    Matches each transcript segment to the speaker turn it overlaps the most.
+
+    A segment fully inside several (overlapping) turns goes to the last of them.
+    Segments that do not overlap any turn are left unmatched.
+
+    Args:
+        start (np.ndarray): Start times of the transcript segments.
+        end (np.ndarray): End times of the transcript segments.
+        turn_start (np.ndarray): Start times of the speaker turns, sorted.
+        turn_end (np.ndarray): End times of the speaker turns.
+
+    Returns:
+        np.ndarray: Index of the matched speaker turn of each segment, -1 if none.
+    """
+    # Turns can overlap, so their ends are not sorted. Turns before `first` end
+    # before the segment starts, turns from `stop` on start after it ends. Turns
+    # that only touch the segment are kept, a zero length segment may lie on them.
+    first = np.searchsorted(np.maximum.accumulate(turn_end), start, side="left")
+    stop = np.searchsorted(turn_start, end, side="right")
+    counts = np.maximum(stop - first, 0)
+
+    # All (segment, candidate turn) pairs
+    rows = np.repeat(np.arange(len(start)), counts)
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    cols += first[rows]
+
+    overlap = np.minimum(turn_end[cols], end[rows]) - np.maximum(
+        turn_start[cols], start[rows]
+    )
+    # Zero length segments only match the turns they are inside of
+    valid = (overlap > 0) | (
+        (turn_start[cols] <= start[rows]) & (end[rows] <= turn_end[cols])
+    )
+    rows, cols, overlap = rows[valid], cols[valid], overlap[valid]
+
+    # Per segment, the pair with the largest overlap (ties: last turn) sorts last
+    order = np.lexsort((cols, overlap, rows))
+    rows, cols = rows[order], cols[order]
+    last = np.append(rows[1:] != rows[:-1], True) if len(rows) else rows.astype(bool)
+
+    turn_idxs = np.full(len(start), -1)
+    turn_idxs[rows[last]] = cols[last]
+    return turn_idxs
+
+
 def combine_transcript_diarization(
-    whisper_json_path: str,
-    diarization_csv_path: str,
+    whisper_json_path: WhisperJson,
+    diarization_csv_path: Diarization,
+    transcript_df: Optional[pd.DataFrame] = None,
 ) -> pd.DataFrame:
     """
     Combines the transcript and diarization into a single Pandas DataFrame.
-    Uses speaker labels from the diarization to assign speakers to the transcript.
+    Uses speaker labels from the diarization to assign speakers to the transcript:
+    each segment gets the speaker of the turn it overlaps the most.
 
     The resulting DataFrame has the following columns:
     - start: The start time of the segment in milliseconds.
@@ -210,27 +320,34 @@ def combine_transcript_diarization(
     - speaker: The speaker label.
 
     Args:
-        whisper_json_path (str): Path to the Whisper JSON file.
-        diarization_csv_path (str): Path to the diarization CSV file.
+        whisper_json_path (WhisperJson): Path to the Whisper JSON file, or the
+            transcription result itself.
+        diarization_csv_path (Diarization): Path to the diarization CSV file, or the
+            pyannote Annotation itself.
+        transcript_df (pd.DataFrame, optional): Transcript already loaded with
+            `load_transcript_df`. If provided, `whisper_json_path` is not read.
 
     Returns:
         pd.DataFrame: The combined transcript and diarization as a Pandas DataFrame.
     """
-    transcript_json = merge_transcript_json(whisper_json_path=whisper_json_path)
-    transcript_df = transcript_json_to_df(transcript_json=transcript_json)
+    if transcript_df is None:
+        transcript_df = load_transcript_df(whisper_json_path=whisper_json_path)
     diarization_df = get_diarization_df(diarization_path=diarization_csv_path)
 
     # Add speaker column to transcript_df with dtype str
     transcript_df["speaker"] = ""
-
-    for diarization_line in diarization_df.iterrows():
-        start = diarization_line[1]["start"]
-        end = diarization_line[1]["end"]
-        speaker = diarization_line[1]["speaker"]
-
-        transcript_df.loc[
-            (transcript_df["start"] >= start) & (transcript_df["end"] <= end), "speaker"
-        ] = speaker
+    if diarization_df.empty:
+        return transcript_df
+
+    diarization_df = diarization_df.sort_values("start", kind="stable")
+    turn_idxs = match_speaker_turns(
+        transcript_df["start"].to_numpy(),
+        transcript_df["end"].to_numpy(),
+        diarization_df["start"].to_numpy(),
+        diarization_df["end"].to_numpy(),
+    )
+    speakers = diarization_df["speaker"].to_numpy(dtype=object)
+    transcript_df["speaker"] = np.where(turn_idxs >= 0, speakers[turn_idxs], "")
 
     return transcript_df
 
@@ -241,8 +358,8 @@ def process_combined_transcript_diarization(
     """
     Post-processes the combined transcript and diarization DataFrame.
 
-    - Replaces empty speaker values with NaN.
-    - Fills in missing speaker values.
+    - Fills in missing speaker values, from the previous segment with a speaker
+        (or the next one, at the start). If no segment has a speaker, they are NaN.
     - Drops rows with empty text.
 
     Args:
@@ -251,12 +368,18 @@ def process_combined_transcript_diarization(
     Returns:
         pd.DataFrame: The processed DataFrame.
     """
-    # Replace empty speaker values with NaN
-    df["speaker"].replace("", float("NaN"), inplace=True)
-
-    # Fill in missing speaker values
-    df["speaker"].ffill(inplace=True)
-    df["speaker"].bfill(inplace=True)
+    speakers = df["speaker"].to_numpy(dtype=object)
+    has_speaker = speakers != ""
+
+    if has_speaker.any():
+        # Fill in missing speaker values: index of the last segment with a speaker,
+        # or of the first one for the segments before it
+        fill_idxs = np.where(has_speaker, np.arange(len(speakers)), -1)
+        np.maximum.accumulate(fill_idxs, out=fill_idxs)
+        fill_idxs[fill_idxs < 0] = np.argmax(has_speaker)
+        df["speaker"] = speakers[fill_idxs]
+    else:
+        df["speaker"] = float("NaN")
 
     # Drop rows with empty text
     df.dropna(subset=["text"], inplace=True)
@@ -264,13 +387,21 @@ def process_combined_transcript_diarization(
     return df
 
 
-def construct_diarised_subtitles(whisper_json: str, diarization_path: str) -> Subtitles:
+def construct_diarised_subtitles(
+    whisper_json: WhisperJson,
+    diarization_path: Diarization,
+    transcript_df: Optional[pd.DataFrame] = None,
+) -> Subtitles:
     """
     Constructs diarized subtitles from a Whisper JSON file and a diarization CSV file.
 
     Args:
-        whisper_json (str): Path to the Whisper JSON file.
-        diarization_path (str): Path to the diarization CSV file.
+        whisper_json (WhisperJson): Path to the Whisper JSON file, or the
+            transcription result itself.
+        diarization_path (Diarization): Path to the diarization CSV file, or the
+            pyannote Annotation itself.
+        transcript_df (pd.DataFrame, optional): Transcript already loaded with
+            `load_transcript_df`. If provided, `whisper_json` is not read.
 
     Returns:
         Subtitles: The diarized subtitles.
@@ -278,6 +409,7 @@ def construct_diarised_subtitles(whisper_json: str, diarization_path: str) -> Su
     diarized_transcript_df = combine_transcript_diarization(
         whisper_json_path=whisper_json,
         diarization_csv_path=diarization_path,
+        transcript_df=transcript_df,
     )
 
     diarized_transcript_df = process_combined_transcript_diarization(
@@ -285,33 +417,39 @@ def construct_diarised_subtitles(whisper_json: str, diarization_path: str) -> Su
     )
 
     subtitles = Subtitles()
-
-    for _, row in diarized_transcript_df.iterrows():
-        subtitle_element = SubtitleElement(
-            start_ms=row["start"],
-            end_ms=row["end"],
-            text=row["text"],
-            speaker=row["speaker"],
-        )
-        subtitles.add_element(subtitle_element)
+    subtitles.add_elements(
+        start_ms=diarized_transcript_df["start"].to_numpy(),
+        end_ms=diarized_transcript_df["end"].to_numpy(),
+        texts=diarized_transcript_df["text"].tolist(),
+        speakers=diarized_transcript_df["speaker"].to_numpy(dtype=object),
+    )
 
     return subtitles
 
 
 def generate_diarized_subtitles(
-    whisper_json: str,
-    diarization_path: str,
+    whisper_json: WhisperJson,
+    diarization_path: Diarization,
     srt_path: str,
     transcribeMe_path: Optional[str] = None,
     max_words_per_line: int = 7,
+    transcript_df: Optional[pd.DataFrame] = None,
 ) -> List[str]:
     """
     Generates diarized subtitles from a Whisper JSON file and a diarization CSV file.
 
+    The transcription result and the diarization can also be passed in directly,
+    which avoids writing them to disk only to parse them again.
+
     Args:
-        whisper_json (str): Path to the Whisper JSON file.
-        diarization_path (str): Path to the diarization CSV file.
+        whisper_json (WhisperJson): Path to the Whisper JSON file, or the
+            transcription result itself.
+        diarization_path (Diarization): Path to the diarization CSV file, or the
+            pyannote Annotation itself.
         srt_path (str): Path to the output
+        transcript_df (pd.DataFrame, optional): Transcript already loaded with
+            `load_transcript_df`, e.g. while the diarization was still running.
+            If provided, `whisper_json` is not read.
 
     Returns:
         List[str]: List of paths to the generated subtitle files.
@@ -320,22 +458,20 @@ def generate_diarized_subtitles(
                 (if transcribeMe_path is not None)
     """
     subtitles = construct_diarised_subtitles(
-        whisper_json=whisper_json, diarization_path=diarization_path
+        whisper_json=whisper_json,
+        diarization_path=diarization_path,
+        transcript_df=transcript_df,
     )
 
-    subtitles_srt = copy.deepcopy(subtitles)
-
-    subtitles_srt.join_adjacent_elements(max_words_per_line=max_words_per_line)
-    subtitles_srt.to_file(srt_path)
+    # Joining does not depend on the display mode, so both outputs share it
+    joined_subtitles = subtitles.joined(max_words_per_line=max_words_per_line)
+    joined_subtitles.to_file(srt_path)
 
     if transcribeMe_path is None:
         return [srt_path]
 
-    subtitles_transcribeMe = copy.deepcopy(subtitles)
-    subtitles_transcribeMe.display_mode = "transcribeMe"
-
-    subtitles_transcribeMe.join_adjacent_elements(max_words_per_line=max_words_per_line)
-    subtitles_transcribeMe.to_file(transcribeMe_path)
+    joined_subtitles.display_mode = "transcribeMe"
+    joined_subtitles.to_file(transcribeMe_path)
 
     return [srt_path, transcribeMe_path]
 
@@ -6,84 +6,517 @@ Transcribe audio file with Whisper.
 import sys
 from pathlib import Path
 
-file = Path(__file__).resolve()
-parent = file.parent
-ROOT = None
-for parent in file.parents:
-    if parent.name == "WhisperNote":
-        ROOT = parent
-sys.path.append(str(ROOT))
-
-# remove current directory from path
-try:
-    sys.path.remove(str(parent))
-except ValueError:
-    pass
+# When run as a script, make the `whispernote` package importable from the repo root
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
 import argparse
+import asyncio
+import bisect
+import functools
+import hashlib
 import json
 import logging
-from typing import Any, Dict, Optional
+import os
+import queue
+import threading
+import time
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+import numpy as np
 
-import pyfiglet
-import torch
-import whisper
-from rich.console import Console
-from rich.logging import RichHandler
+try:
+    import orjson
+except ImportError:  # fall back to the standard library encoder
+    orjson = None
 
 import whispernote.helpers.utils as utils
-from whispernote.helpers import ffprobe
+
+# torch, whisper and faster-whisper take seconds to import, and are only imported
+# by the functions that use them, so that --help, or failing on bad arguments, is
+# immediate
+if TYPE_CHECKING:
+    import faster_whisper
+    import whisper
 
 MODULE_NAME = "transcribe"
 
 logger = logging.getLogger(MODULE_NAME)
-logargs = {
-    "level": logging.INFO,
-    # "format": "%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s",
-    "format": "%(message)s",
-    "handlers": [RichHandler(rich_tracebacks=True)],
-}
-logging.basicConfig(**logargs)
 
-console = Console()
+BACKENDS = ["openai", "faster"]
+"""Transcription backends: the reference openai-whisper implementation, or
+faster-whisper (CTranslate2), which runs the model quantized to int8."""
+
+CPU_QUANTIZATIONS = ["none", "int8"]
+"""Quantizations of the openai-whisper model on CPU: none (float32), or dynamic int8
+quantization of the linear layers."""
+
+OUTPUT_FORMATS = ["json", "jsonl"]
+"""Output formats: the whole result as one JSON object, or one JSON object per
+segment and line, see `transcribe_jsonl`."""
+
+SegmentCallback = Callable[[Dict[str, Any]], None]
+"""Called with each segment of a transcript, see `transcribe`."""
+
+VADS = ["none", "silero"]
+"""Voice activity detection before transcription: none, or Silero VAD, which drops
+the silent parts of the audio."""
+
+whisper_model: "whisper.Whisper" = None  # type: ignore
+device: str = None  # type: ignore
+
+
+def _import_faster_whisper(feature: str) -> ModuleType:
+    """
+    Imports faster-whisper, which is only needed for some features.
+
+    Args:
+        feature (str): the feature that needs faster-whisper, for the error message
+
+    Returns:
+        ModuleType: the faster_whisper module
+
+    Raises:
+        ImportError: If faster-whisper is not installed.
+    """
+    try:
+        import faster_whisper
+    except ImportError as e:
+        raise ImportError(
+            f"{feature} needs faster-whisper: pip install faster-whisper"
+        ) from e
+    return faster_whisper
+
+
+def quantize_dynamic(loaded: "whisper.Whisper") -> "whisper.Whisper":
+    """
+    Quantizes the linear layers of a Whisper model on CPU to int8. The weights are
+    stored as int8, and the activations quantized on the fly, per batch.
+
+    Args:
+        loaded (whisper.Whisper): Whisper model, on CPU
+
+    Returns:
+        whisper.Whisper: the quantized Whisper model
+    """
+    import torch
+    import whisper
+
+    # openai-whisper subclasses its linear layers to cast the weights to the input
+    # dtype, which on CPU is always float32. quantize_dynamic only swaps modules of
+    # the exact nn.Linear type, so they are turned back into plain nn.Linear first.
+    for module in loaded.modules():
+        if isinstance(module, whisper.model.Linear):
+            module.__class__ = torch.nn.Linear
+
+    return torch.ao.quantization.quantize_dynamic(
+        loaded, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+@functools.lru_cache(maxsize=2)
+def _load_whisper(
+    model: str,
+    device_name: str,
+    in_memory: bool,
+    compile_model: bool = False,
+    cpu_quant: str = "none",
+) -> "whisper.Whisper":
+    """
+    Loads a Whisper model and sends it to the device. Cached, so the weights are
+    read and copied to the device only once per process.
+
+    Args:
+        model (str): model to load
+        device_name (str): device to send the model to, e.g. "cuda:0"
+        in_memory (bool): load model in memory
+        compile_model (bool): compile the audio encoder with torch.compile, on GPU
+        cpu_quant (str): quantization of the model on CPU, one of CPU_QUANTIZATIONS
+
+    Returns:
+        whisper.Whisper: Whisper model
+    """
+    import torch
+    import whisper
+
+    logger.info(f"Loading transcription model: '{model}'")
+    loaded = whisper.load_model(model, in_memory=in_memory, device=device_name)
+
+    if compile_model and device_name != "cpu":
+        # The encoder always sees 30 s of audio, so it is captured once into CUDA
+        # graphs and replayed. The decoder is left alone, its key/value cache is
+        # kept by forward hooks, which torch.compile does not reliably honour.
+        logger.info("Compiling the transcription model encoder")
+        loaded.encoder = torch.compile(loaded.encoder, mode="reduce-overhead")
+
+    if cpu_quant == "int8" and device_name == "cpu":
+        logger.info("Quantizing the transcription model to int8")
+        loaded = quantize_dynamic(loaded)
+    return loaded
+
+
+def get_compute_type(device_name: str) -> str:
+    """
+    Selects the faster-whisper compute type for the device: int8 weights with
+    float16 activations on GPUs with tensor cores (Volta and newer), int8 otherwise.
+
+    Args:
+        device_name (str): device the model runs on, e.g. "cuda:0"
+
+    Returns:
+        str: the CTranslate2 compute type
+    """
+    if device_name == "cpu":
+        return "int8"
+
+    import torch
+
+    major, _ = torch.cuda.get_device_capability(torch.device(device_name))
+    return "int8_float16" if major >= 7 else "int8"
+
+
+@functools.lru_cache(maxsize=2)
+def _load_faster_whisper(
+    model: str, device_name: str, threads: int, compute_type: Optional[str] = None
+) -> "faster_whisper.WhisperModel":
+    """
+    Loads a faster-whisper model on the device. Cached, so the weights are read and
+    copied to the device only once per process.
+
+    Args:
+        model (str): model to load
+        device_name (str): device to load the model on, e.g. "cuda:0"
+        threads (int): number of threads to use, when running on CPU
+        compute_type (str, optional): CTranslate2 compute type, e.g. "int8_float16"
+            for int8 weights with float16 activations. Selected for the device with
+            `get_compute_type` if not provided.
+
+    Returns:
+        faster_whisper.WhisperModel: faster-whisper model
+    """
+    import torch
+
+    faster_whisper = _import_faster_whisper("The 'faster' transcription backend")
+    if compute_type is None:
+        compute_type = get_compute_type(device_name)
+    logger.info(f"Loading transcription model: '{model}' ({compute_type})")
+    torch_device = torch.device(device_name)
+    return faster_whisper.WhisperModel(
+        model,
+        device=torch_device.type,
+        device_index=torch_device.index or 0,
+        compute_type=compute_type,
+        cpu_threads=threads,
+    )
+
+
+def set_cpu_threads(threads: int) -> None:
+    """
+    Sets the number of threads torch runs on, on CPU. Operators run one at a time,
+    each on `threads` threads, so the threads are not oversubscribed by nested
+    parallelism.
+
+    Args:
+        threads (int): number of threads to use
+
+    Returns:
+        None
+    """
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # only possible before the first parallel operator
+        logger.debug("Number of inter-op threads already set")
+
+
+def set_cpu_affinity(cores: Iterable[int]) -> int:
+    """
+    Pins the process to CPU cores, so its threads do not migrate between cores (or
+    NUMA nodes) and evict each other's caches. The threads of OpenMP and MKL,
+    including those of subprocesses, are limited to the number of cores.
+
+    Args:
+        cores (Iterable[int]): the cores to run on
+
+    Returns:
+        int: the number of cores the process runs on
+    """
+    os.sched_setaffinity(0, cores)
+    threads = len(os.sched_getaffinity(0))
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    logger.info(f"Pinned to {threads} CPU cores")
+    return threads
+
+
+def select_device(
+    force_cpu: bool = False, threads: int = 8, gpu_lock_dir: Optional[str] = None
+) -> str:
+    """
+    Selects the device to run the model on: the GPU with the most free memory if
+    available, the CPU if not. Selected on the first call only, later calls return
+    the same device.
+
+    Args:
+        force_cpu (bool): run on CPU, even if a GPU is available
+        threads (int): number of threads to use, when running on CPU
+        gpu_lock_dir (str, optional): claim the GPU with a lock file in this
+            directory, so that other processes using it pick another GPU.
+            See `utils.lock_free_gpu_idx`
+
+    Returns:
+        str: the device to run on
+    """
+    if force_cpu:
+        logger.info("Sending transcription model to CPU (Overridden)")
+        set_cpu_threads(threads)
+        return "cpu"
+
+    global device  # pylint: disable=global-statement
+    if device is not None:
+        return device
+
+    if utils.check_gpu():
+        if gpu_lock_dir:
+            gpu_idx = utils.lock_free_gpu_idx(gpu_lock_dir)
+        else:
+            gpu_idx = utils.get_free_gpu_idx()
+        device = f"cuda:{gpu_idx}"
+        logger.info(f"Sending transcription model to GPU {gpu_idx}")
+    else:
+        device = "cpu"
+        logger.info("Sending transcription model to CPU")
+        set_cpu_threads(threads)
+
+    return device
+
+
+def _file_digest(path: str) -> str:
+    """
+    Hashes the contents of a file.
+
+    Args:
+        path (str): file to hash
+
+    Returns:
+        str: SHA-1 hex digest of the file
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_audio_cache_dir() -> Path:
+    """
+    Returns the default directory for cached decoded audio,
+    $XDG_CACHE_HOME/whispernote/audio (~/.cache/whispernote/audio).
+
+    Returns:
+        Path: the cache directory
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "whispernote" / "audio"
+
+
+def load_audio(path: str, cache_dir: Optional[Path] = None) -> np.ndarray:
+    """
+    Decodes an audio file to 16 kHz mono, like `whisper.load_audio`.
+
+    With a cache directory, the decoded audio is kept there, keyed by the hash of
+    the file, and later runs on the same file skip ffmpeg.
+
+    Args:
+        path (str): audio file to decode
+        cache_dir (Path, optional): directory of cached decoded audio.
+            Defaults to None (no caching).
+
+    Returns:
+        np.ndarray: the decoded audio, float32
+    """
+    import whisper
+
+    if cache_dir is None:
+        return whisper.load_audio(path)
 
-whisper_model: whisper.Whisper = None  # type: ignore
+    cached_file = Path(cache_dir) / f"{_file_digest(path)}.npy"
+    if cached_file.is_file():
+        logger.debug(f"Using decoded audio of {path} from {cached_file}")
+        return np.load(cached_file)
+
+    audio = whisper.load_audio(path)
+    cached_file.parent.mkdir(parents=True, exist_ok=True)
+    # Written next to the cache entry and renamed, so that readers never see a
+    # partially written file
+    partial_file = cached_file.with_suffix(f".{os.getpid()}.partial")
+    with open(partial_file, "wb") as file:
+        np.save(file, audio)
+    partial_file.replace(cached_file)
+    return audio
 
 
 def load_model(
-    model: str, in_memory: bool = True, force_cpu: bool = False, threads: int = 8
-) -> whisper.Whisper:
+    model: str,
+    in_memory: bool = True,
+    force_cpu: bool = False,
+    threads: int = 8,
+    backend: str = "openai",
+    compute_type: Optional[str] = None,
+    compile_model: bool = False,
+    cpu_quant: str = "none",
+) -> "whisper.Whisper":
     """
     Loads model to memory. Sends model to GPU if available, falls back to CPU if not.
+    A model already loaded on the same device is reused.
 
     Args:
         model (str): model to load
         in_memory (bool): load model in memory
         force_cpu (bool): force model to CPU
         threads (int): number of threads to use
+        backend (str): transcription backend, one of BACKENDS
+        compute_type (str, optional): compute type of the "faster" backend,
+            selected for the device if not provided
+        compile_model (bool): compile the model with torch.compile, on GPU with the
+            "openai" backend
+        cpu_quant (str): quantization of the model on CPU with the "openai"
+            backend, one of CPU_QUANTIZATIONS
 
     Returns:
-        whisper.Whisper: Whisper model
+        whisper.Whisper: Whisper model (faster_whisper.WhisperModel for the
+            "faster" backend)
     """
     global whisper_model  # pylint: disable=global-statement
-    if force_cpu:
-        device = "cpu"
-        logger.info("Sending transcription model to CPU (Overridden)")
-        torch.set_num_threads(threads)
+    device_name = select_device(force_cpu=force_cpu, threads=threads)
+    if backend == "faster":
+        whisper_model = _load_faster_whisper(
+            model, device_name, threads, compute_type
+        )
     else:
-        if utils.check_gpu():
-            gpu_idx = utils.get_free_gpu_idx()
-            device = f"cuda:{gpu_idx}"
-            logger.info(f"Sending transcription model to GPU {gpu_idx}")
-        else:
-            device = "cpu"
-            logger.info("Sending transcription model to CPU")
-            torch.set_num_threads(threads)
-    logger.info(f"Loading transcription model: '{model}'")
-    whisper_model = whisper.load_model(model, in_memory=in_memory, device=device)
+        whisper_model = _load_whisper(
+            model, device_name, in_memory, compile_model, cpu_quant
+        )
     return whisper_model
 
 
+def _faster_whisper_result(
+    segments: Iterable[Any], info: Any, on_segment: Optional[SegmentCallback] = None
+) -> Dict[str, Any]:
+    """
+    Collects the output of faster-whisper into the result format of openai-whisper.
+
+    Args:
+        segments (Iterable[faster_whisper.transcribe.Segment]): transcribed segments
+        info (faster_whisper.transcribe.TranscriptionInfo): transcription info
+        on_segment (SegmentCallback, optional): called with each segment, as
+            faster-whisper yields it
+
+    Returns:
+        Dict[str, Any]: result of transcription as a JSON object
+    """
+    result_segments = []
+    for segment in segments:
+        result_segment = {
+            "id": segment.id,
+            "seek": segment.seek,
+            "start": segment.start,
+            "end": segment.end,
+            "text": segment.text,
+            "tokens": segment.tokens,
+            "temperature": segment.temperature,
+            "avg_logprob": segment.avg_logprob,
+            "compression_ratio": segment.compression_ratio,
+            "no_speech_prob": segment.no_speech_prob,
+        }
+        if segment.words is not None:
+            result_segment["words"] = [
+                {
+                    "word": word.word,
+                    "start": word.start,
+                    "end": word.end,
+                    "probability": word.probability,
+                }
+                for word in segment.words
+            ]
+        result_segments.append(result_segment)
+        if on_segment is not None:
+            on_segment(result_segment)
+
+    return {
+        "text": "".join(segment["text"] for segment in result_segments),
+        "segments": result_segments,
+        "language": info.language,
+    }
+
+
+def detect_speech(audio: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Detects speech in audio with Silero VAD, as bundled with faster-whisper.
+
+    Args:
+        audio (np.ndarray): audio, 16 kHz mono
+
+    Returns:
+        List[Tuple[int, int]]: (start, end) samples of each stretch of speech
+    """
+    _import_faster_whisper("Silero VAD")
+    from faster_whisper.vad import get_speech_timestamps
+
+    return [(span["start"], span["end"]) for span in get_speech_timestamps(audio)]
+
+
+def restore_timestamps(result: Dict[str, Any], spans: List[Tuple[int, int]]) -> None:
+    """
+    Shifts the timestamps of the transcript of the speech in audio, as concatenated
+    by `detect_speech` spans, back to times in the original audio, in place.
+
+    Args:
+        result (Dict[str, Any]): result of transcription of the speech only audio
+        spans (List[Tuple[int, int]]): (start, end) samples of each stretch of
+            speech in the original audio
+
+    Returns:
+        None
+    """
+    import whisper
+
+    # Start of each stretch of speech, in the original and in the speech only audio
+    original_starts = [start for start, _ in spans]
+    speech_starts = [0]
+    for start, end in spans[:-1]:
+        speech_starts.append(speech_starts[-1] + end - start)
+
+    def original_time(time: float, is_end: bool) -> float:
+        sample = time * whisper.audio.SAMPLE_RATE
+        # A time at the boundary of two stretches ends the first, or starts the next
+        search = bisect.bisect_left if is_end else bisect.bisect_right
+        span_idx = max(search(speech_starts, sample) - 1, 0)
+        sample += original_starts[span_idx] - speech_starts[span_idx]
+        return round(sample / whisper.audio.SAMPLE_RATE, 3)
+
+    for segment in result["segments"]:
+        segment["start"] = original_time(segment["start"], is_end=False)
+        segment["end"] = original_time(segment["end"], is_end=True)
+        for word in segment.get("words", []):
+            word["start"] = original_time(word["start"], is_end=False)
+            word["end"] = original_time(word["end"], is_end=True)
+
+
 def transcribe(
     input_audio_file_path: str,
     language: Optional[str] = None,
@@ -94,6 +527,16 @@ def transcribe(
     load_model_in_memory: bool = True,
     force_cpu: bool = False,
     threads: int = 8,
+    backend: str = "openai",
+    compute_type: Optional[str] = None,
+    chunk_batch_size: Optional[int] = None,
+    audio: Optional[np.ndarray] = None,
+    audio_cache_dir: Optional[Path] = None,
+    compile_model: bool = False,
+    cpu_quant: str = "none",
+    vad: str = "none",
+    greedy: bool = False,
+    on_segment: Optional[SegmentCallback] = None,
 ) -> Dict[str, Any]:
     """Transcribe audio file with Whisper
 
@@ -102,67 +545,506 @@ def transcribe(
         language (str, optional): language of the audio file, if known. Defaults to None.
         model (str, optional): model to use for transcription. Defaults to "base".
         word_timestamps (bool, optional): include word timestamps in output. Defaults to False.
+        backend (str, optional): transcription backend, one of BACKENDS.
+            Defaults to "openai".
+        compute_type (str, optional): compute type of the "faster" backend, e.g.
+            "int8_float16". Selected for the device if not provided.
+        chunk_batch_size (int, optional): decode this many 30 s chunks of the audio
+            together, in one batch. Chunks are then decoded independently of each
+            other, without conditioning on the previous text. Needs the "faster"
+            backend. Defaults to None (sequential decoding).
+        audio (np.ndarray, optional): the audio of the input file, already decoded
+            to 16 kHz mono with `whisper.load_audio`. The file is not read if provided.
+        audio_cache_dir (Path, optional): directory to cache the decoded audio in,
+            see `load_audio`. Defaults to None (no caching).
+        compile_model (bool, optional): compile the model with torch.compile, on
+            GPU with the "openai" backend. The first file takes longer, while the
+            model is compiled. Defaults to False.
+        cpu_quant (str, optional): quantization of the "openai" backend's model on
+            CPU, one of CPU_QUANTIZATIONS. Defaults to "none".
+        vad (str, optional): voice activity detection, one of VADS. With "silero",
+            only the speech in the audio is transcribed, and the timestamps are
+            those of the original audio. Defaults to "none".
+        greedy (bool, optional): decode greedily, at temperature 0 only, without
+            falling back to sampling at higher temperatures when the decoded text
+            is repetitive or unlikely. Cannot be combined with a beam size.
+            Defaults to False.
+        on_segment (SegmentCallback, optional): called with each segment of the
+            result. With the "faster" backend, as soon as the segment is
+            transcribed. openai-whisper only returns the segments once the whole
+            file is transcribed.
 
     Returns:
         Dict[str, Any]: result of transcription as a JSON object
     """
+    if chunk_batch_size and backend != "faster":
+        raise ValueError("Batched chunk decoding needs the 'faster' backend")
+    if greedy and beam_size is not None:
+        raise ValueError("Greedy decoding cannot be combined with a beam size")
+    # A single temperature, so that no window is decoded twice
+    sampling_options: Dict[str, Any] = {"temperature": (0.0,)} if greedy else {}
+    # The faster backend runs the VAD itself, openai-whisper is given the speech
+    vad_speech = vad != "none" and backend != "faster"
+    if audio is None and (audio_cache_dir is not None or vad_speech):
+        audio = load_audio(input_audio_file_path, cache_dir=audio_cache_dir)
+    audio_input = audio if audio is not None else input_audio_file_path
+
     logger.info(f"Transcribing {input_audio_file_path} with Whisper")
 
     logger.info("Starting transcription")
     logger.debug(f"language: '{language}'")
     logger.debug(f"word_timestamps: {word_timestamps}")
 
-    global whisper_model  # pylint: disable=global-statement
-    if whisper_model is None:
-        load_model(
-            model, in_memory=load_model_in_memory, threads=threads, force_cpu=force_cpu
-        )
-    result = whisper_model.transcribe(
-        input_audio_file_path,
-        language=language,
-        word_timestamps=word_timestamps,
-        verbose=False,
-        beam_size=beam_size,
-        condition_on_previous_text=condition_on_previous_text,
+    loaded_model = load_model(
+        model,
+        in_memory=load_model_in_memory,
+        threads=threads,
+        force_cpu=force_cpu,
+        backend=backend,
+        compute_type=compute_type,
+        compile_model=compile_model,
+        cpu_quant=cpu_quant,
     )
+    if backend == "faster" and chunk_batch_size:
+        faster_whisper = _import_faster_whisper("Batched chunk decoding")
+        if not hasattr(faster_whisper, "BatchedInferencePipeline"):
+            raise ImportError(
+                "Batched chunk decoding needs faster-whisper 1.1 or newer: "
+                "pip install -U faster-whisper"
+            )
+        # Speech chunks are decoded chunk_batch_size at a time, in one forward pass
+        batched_model = faster_whisper.BatchedInferencePipeline(model=loaded_model)
+        segments, info = batched_model.transcribe(
+            audio_input,
+            language=language,
+            word_timestamps=word_timestamps,
+            beam_size=beam_size if beam_size is not None else 1,
+            batch_size=chunk_batch_size,
+            **sampling_options,
+        )
+        result = _faster_whisper_result(segments, info, on_segment)
+    elif backend == "faster":
+        # Without a beam size, openai-whisper decodes greedily
+        segments, info = loaded_model.transcribe(
+            audio_input,
+            language=language,
+            word_timestamps=word_timestamps,
+            beam_size=beam_size if beam_size is not None else 1,
+            condition_on_previous_text=condition_on_previous_text,
+            vad_filter=vad != "none",
+            **sampling_options,
+        )
+        result = _faster_whisper_result(segments, info, on_segment)
+    else:
+        spans = None
+        if vad_speech:
+            spans = detect_speech(audio)
+            logger.info(f"Detected {len(spans)} stretches of speech")
+            if not spans:
+                logger.info("Transcription complete, no speech detected")
+                return {"text": "", "segments": [], "language": language}
+            audio_input = np.concatenate([audio[start:end] for start, end in spans])
+
+        if loaded_model.device.type == "cuda":
+            # openai-whisper computes the log-mel spectrogram (torch.stft) on the
+            # device of the audio, and copies it to the model window by window.
+            # Sent to the GPU first, the spectrogram is computed there, in one go.
+            import torch
+
+            if isinstance(audio_input, str):
+                audio_input = load_audio(audio_input)
+            audio_input = torch.from_numpy(audio_input).to(loaded_model.device)
+
+        result = loaded_model.transcribe(
+            audio_input,
+            language=language,
+            word_timestamps=word_timestamps,
+            verbose=False,
+            beam_size=beam_size,
+            condition_on_previous_text=condition_on_previous_text,
+            **sampling_options,
+        )
+        if spans is not None:
+            restore_timestamps(result, spans)
+        if on_segment is not None:
+            for segment in result["segments"]:
+                on_segment(segment)
 
     logger.info("Transcription complete")
     return result
 
 
-def write_output(output: str, result: dict) -> None:
+def dumps(result: dict, pretty: bool = False) -> bytes:
+    """Serialize a result to JSON, with orjson when it is installed
+
+    Args:
+        result (dict): result of transcription
+        pretty (bool, optional): indent the JSON, for reading by humans.
+            Defaults to False.
+
+    Returns:
+        bytes: the UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(result, option=option)
+
+    # Serialized in one go: json.dump issues a write for every token
+    return json.dumps(result, indent=4 if pretty else None).encode("utf-8")
+
+
+def write_output(output: str, result: dict, pretty: bool = False) -> None:
     """Write output to file
 
     Args:
         output (str): output file
         result (dict): result of transcription
+        pretty (bool, optional): indent the JSON, for reading by humans.
+            Defaults to False.
     """
     logger.info(f"Writing output to {output}")
-    with open(output, "w", encoding="utf-8") as output_file:
-        json.dump(result, output_file, indent=4)
+    Path(output).write_bytes(dumps(result, pretty=pretty))
 
 
-def print_duration(input_file: str):
+def transcribe_jsonl(output: str, **options: Any) -> Dict[str, Any]:
+    """Transcribe audio file with Whisper, writing the segments to a JSON Lines
+    file. With the "faster" backend, each segment is written as soon as it is
+    transcribed, so the segments so far are kept if transcription fails part way.
+    openai-whisper only returns the segments once the whole file is transcribed,
+    so with the "openai" backend they are all written at the end.
+
+    Args:
+        output (str): output file, one segment per line
+        **options: arguments passed on to `transcribe`
+
+    Returns:
+        Dict[str, Any]: result of transcription as a JSON object
+    """
+    if options.get("backend", "openai") != "faster":
+        logger.warning(
+            "The openai backend returns the segments once the whole file is "
+            "transcribed, use --backend faster to write them as they are transcribed"
+        )
+    logger.info(f"Writing segments to {output}")
+    with open(output, "wb") as file:
+
+        def write_segment(segment: Dict[str, Any]) -> None:
+            file.write(dumps(segment) + b"\n")
+            file.flush()
+
+        return transcribe(on_segment=write_segment, **options)
+
+
+def print_duration(audio: np.ndarray):
     """
-    Prints the duration of an input audio file.
+    Prints the duration of an input audio file, from its decoded audio.
 
     Args:
-        input_file (str): The path to the input audio file.
+        audio (np.ndarray): the audio of the input file, 16 kHz mono, as decoded
+            by `load_audio`
 
     Returns:
         None
     """
-    metadata = ffprobe.get_metadata(Path(input_file))
-    duration = metadata["format"]["duration"]
-    duration = float(duration)
+    import whisper
+
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
     logger.debug(f"Duration of input file is {duration:.2f} seconds")
 
 
+def _preload_model(options: Dict[str, Any]) -> None:
+    """
+    Loads the model that `transcribe` will use with these options, so that loading
+    errors surface before the first job.
+
+    Args:
+        options (Dict[str, Any]): arguments for `transcribe`
+
+    Returns:
+        None
+    """
+    load_model(
+        options.get("model", "base"),
+        in_memory=options.get("load_model_in_memory", True),
+        force_cpu=options.get("force_cpu", False),
+        threads=options.get("threads", 8),
+        backend=options.get("backend", "openai"),
+        compute_type=options.get("compute_type"),
+        compile_model=options.get("compile_model", False),
+        cpu_quant=options.get("cpu_quant", "none"),
+    )
+
+
+BatchJob = Tuple[str, str, Union[np.ndarray, Exception]]
+"""Input file, output file, and the decoded audio (or why it could not be decoded)."""
+
+
+def _read_batch(
+    lines: Iterable[str],
+    jobs: "queue.Queue[Optional[BatchJob]]",
+    audio_cache_dir: Optional[Path] = None,
+) -> None:
+    """
+    Reads the batch lines, and decodes the audio of each file ahead of its
+    transcription. Run on its own thread by `run_batch`, ends the queue with None.
+
+    Args:
+        lines (Iterable[str]): the input<tab>output lines, e.g. sys.stdin
+        jobs (queue.Queue[Optional[BatchJob]]): where to put the decoded files
+        audio_cache_dir (Path, optional): directory of cached decoded audio
+
+    Returns:
+        None
+    """
+    try:
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+
+            input_file, _, output_file = line.partition("\t")
+            try:
+                if not output_file:
+                    raise ValueError("expected <input>\\t<output>")
+                if not Path(input_file).is_file():
+                    raise FileNotFoundError(f"Input file {input_file} does not exist")
+                audio: Union[np.ndarray, Exception] = load_audio(
+                    input_file, cache_dir=audio_cache_dir
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                audio = e
+            jobs.put((input_file, output_file, audio))
+    finally:
+        jobs.put(None)
+
+
+def run_batch(
+    lines: Iterable[str], out: TextIO, output_format: str = "json", **options: Any
+) -> int:
+    """
+    Transcribes a batch of audio files with a single model load.
+
+    Each line holds an input audio file and the output file, separated by a tab.
+    For each, a result line is written to `out`:
+    - OK<tab>output file<tab>seconds taken, or
+    - ERR<tab>input file<tab>error message
+
+    The audio of the next file is decoded while the current one is transcribed, so
+    the model does not wait on ffmpeg between files.
+
+    Args:
+        lines (Iterable[str]): the input<tab>output lines, e.g. sys.stdin
+        out (TextIO): where to write the result lines, e.g. sys.stdout
+        output_format (str, optional): format of the output files, one of
+            OUTPUT_FORMATS. Defaults to "json".
+        **options: arguments passed on to `transcribe`
+
+    Returns:
+        int: the number of files that failed
+    """
+    _preload_model(options)
+
+    # At most one decoded file waits in the queue, which bounds the memory used
+    jobs: "queue.Queue[Optional[BatchJob]]" = queue.Queue(maxsize=1)
+    reader = threading.Thread(
+        target=_read_batch,
+        args=(lines, jobs, options.get("audio_cache_dir")),
+        name="batch-reader",
+        daemon=True,
+    )
+    reader.start()
+
+    failures = 0
+    for input_file, output_file, audio in iter(jobs.get, None):
+        start_time = time.perf_counter()
+        try:
+            if isinstance(audio, Exception):
+                raise audio
+
+            if output_format == "jsonl":
+                transcribe_jsonl(
+                    output_file,
+                    input_audio_file_path=input_file,
+                    audio=audio,
+                    **options,
+                )
+            else:
+                result = transcribe(
+                    input_audio_file_path=input_file, audio=audio, **options
+                )
+                write_output(output_file, result)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception(f"Failed to transcribe {input_file}")
+            failures += 1
+            # Kept on one line, so every file gets exactly one result line
+            message = " ".join(str(e).split())
+            out.write(f"ERR\t{input_file}\t{message}\n")
+        else:
+            out.write(f"OK\t{output_file}\t{time.perf_counter() - start_time:.2f}\n")
+        out.flush()
+
+    reader.join()
+    return failures
+
+
+SERVE_REQUEST_OPTIONS = {
+    "language",
+    "beam_size",
+    "condition_on_previous_text",
+    "word_timestamps",
+    "chunk_batch_size",
+    "vad",
+    "greedy",
+}
+"""Transcription options a request to the server can set. The model and backend
+are fixed when the server starts."""
+
+
+async def _handle_request(
+    line: bytes, lock: asyncio.Lock, options: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Runs one transcription request of the server.
+
+    Args:
+        line (bytes): the request, a JSON object with the "input" audio file, an
+            optional "output" file, and any of SERVE_REQUEST_OPTIONS
+        lock (asyncio.Lock): held while the model runs, one request at a time
+        options (Dict[str, Any]): the server's arguments for `transcribe`
+
+    Returns:
+        Dict[str, Any]: the response. {"status": "ok"} with the "output" file it was
+            written to or the "result" itself, or {"status": "error", "error": ...}
+    """
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict) or "input" not in request:
+            raise ValueError("expected a JSON object with an 'input' audio file")
+        unknown = set(request) - SERVE_REQUEST_OPTIONS - {"input", "output"}
+        if unknown:
+            raise ValueError(f"unknown request keys: {sorted(unknown)}")
+
+        input_file = request["input"]
+        if not Path(input_file).is_file():
+            raise FileNotFoundError(f"Input file {input_file} does not exist")
+
+        job_options = dict(options)
+        job_options.update(
+            (key, request[key]) for key in SERVE_REQUEST_OPTIONS if key in request
+        )
+        async with lock:
+            result = await asyncio.to_thread(
+                transcribe, input_audio_file_path=input_file, **job_options
+            )
+            # Hand back the cached blocks of this job, before the next one
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        if "output" not in request:
+            return {"status": "ok", "result": result}
+
+        await asyncio.to_thread(write_output, request["output"], result)
+        return {"status": "ok", "output": request["output"]}
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("Failed to handle transcription request")
+        return {"status": "error", "error": str(e)}
+
+
+async def _serve(socket_path: str, options: Dict[str, Any]) -> None:
+    """
+    Serves transcription requests on a Unix socket, until cancelled.
+
+    Args:
+        socket_path (str): path of the Unix socket to listen on
+        options (Dict[str, Any]): arguments for `transcribe`
+
+    Returns:
+        None
+    """
+    lock = asyncio.Lock()
+
+    async def handle_client(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            async for line in reader:
+                if not line.strip():
+                    continue
+                response = await _handle_request(line, lock, options)
+                writer.write(dumps(response) + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle_client, path=socket_path)
+    logger.info(f"Serving transcription requests on {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+def serve(socket_path: str, **options: Any) -> None:
+    """
+    Runs a transcription server: loads the model once, then transcribes the
+    requests sent to a Unix socket, one JSON object per line, e.g.
+    {"input": "audio.mp3", "output": "audio.json", "language": "en"}
+
+    Each request gets one JSON response line, see `_handle_request`. Try it with
+    `socat - UNIX-CONNECT:<socket_path>`.
+
+    Args:
+        socket_path (str): path of the Unix socket to listen on. A stale socket
+            left at the path is replaced.
+        **options: arguments passed on to `transcribe`
+
+    Returns:
+        None
+    """
+    _preload_model(options)
+
+    socket_file = Path(socket_path)
+    if socket_file.is_socket():
+        socket_file.unlink()
+
+    try:
+        asyncio.run(_serve(socket_path, options))
+    except KeyboardInterrupt:
+        logger.info("Transcription server stopped")
+    finally:
+        socket_file.unlink(missing_ok=True)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Transcribe audio file with Whisper")
 
-    parser.add_argument("--input", type=str, help="input audio file", required=True)
-    parser.add_argument("--output", type=str, help="output file", required=True)
+    parser.add_argument("--input", type=str, help="input audio file")
+    parser.add_argument("--output", type=str, help="output file")
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        help="json: the whole result, written once transcribed. jsonl: one segment "
+        "per line, written as each is transcribed with the faster backend (at the "
+        "end with the openai backend)",
+        choices=OUTPUT_FORMATS,
+        default="json",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="read <input>\\t<output> lines from stdin and transcribe them all with "
+        "one model load. Writes OK/ERR result lines to stdout",
+    )
+    parser.add_argument(
+        "--serve",
+        type=str,
+        metavar="SOCKET",
+        help="load the model once and serve JSON transcription requests on this "
+        "Unix socket, one per line",
+        required=False,
+    )
     parser.add_argument(
         "--language", type=str, help="language of the audio file, if known"
     )
@@ -187,8 +1069,10 @@ def main():
     )
     parser.add_argument(
         "--condition-on-previous-text",
-        type=bool,
-        help="condition on previous text. False helps prevent the model from repeating itself.",
+        action=argparse.BooleanOptionalAction,
+        help="condition on previous text. --no-condition-on-previous-text helps "
+        "prevent the model from repeating itself, and decodes each 30 s window "
+        "independently",
         default=True,
     )
     parser.add_argument(
@@ -197,8 +1081,110 @@ def main():
         help="beam size",
         required=False,
     )
+    parser.add_argument(
+        "--greedy",
+        action="store_true",
+        help="decode greedily at temperature 0 only, without falling back to "
+        "higher temperatures. Faster, but more prone to repetition",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        help="transcription backend: openai-whisper, or faster-whisper (int8)",
+        choices=BACKENDS,
+        default="openai",
+    )
+    parser.add_argument(
+        "--compute-type",
+        type=str,
+        help="compute type of the faster backend, e.g. int8_float16 (int8 weights, "
+        "float16 activations), int8_bfloat16 or float16. Selected for the device if "
+        "omitted",
+        required=False,
+    )
+    parser.add_argument(
+        "--compile",
+        action=argparse.BooleanOptionalAction,
+        help="compile the model with torch.compile (openai backend, on GPU). Pays "
+        "off in --batch and --serve modes, where the model is reused",
+        default=False,
+    )
+    parser.add_argument(
+        "--cpu-quant",
+        type=str,
+        help="quantization of the model on CPU (openai backend): none (float32), or "
+        "int8 weights with dynamically quantized activations",
+        choices=CPU_QUANTIZATIONS,
+        default="none",
+    )
+    parser.add_argument(
+        "--cpu-affinity",
+        type=str,
+        metavar="CORES",
+        help="pin the process to these CPU cores, e.g. 0-7 or 0,2,4,6, and run on as "
+        "many threads on CPU. Pick one core per physical core, on one NUMA node",
+        required=False,
+    )
+    parser.add_argument(
+        "--vad",
+        type=str,
+        help="voice activity detection: none, or silero to only transcribe the "
+        "speech, skipping silence (needs faster-whisper)",
+        choices=VADS,
+        default="none",
+    )
+    parser.add_argument(
+        "--gpu-lock-dir",
+        type=str,
+        metavar="DIR",
+        help="claim the GPU with a lock file in this directory, so that concurrent "
+        "transcriptions using the same directory run on different GPUs",
+        required=False,
+    )
+    parser.add_argument(
+        "--cache-audio",
+        action=argparse.BooleanOptionalAction,
+        help="cache the decoded audio, keyed by the hash of the file, so later runs "
+        "on the same file skip decoding (in $XDG_CACHE_HOME/whispernote/audio)",
+        default=False,
+    )
+    parser.add_argument(
+        "--chunk-batch-size",
+        type=int,
+        help="decode this many 30 s chunks of the audio together (faster backend). "
+        "Chunks are then not conditioned on the previous text",
+        required=False,
+    )
 
     args = parser.parse_args()
+    if args.batch and args.serve:
+        parser.error("--batch and --serve cannot be combined")
+    if args.serve and args.output_format != "json":
+        parser.error("--output-format does not apply to --serve")
+    if args.greedy and args.beam_size is not None:
+        parser.error("--greedy and --beam-size cannot be combined")
+    cores = None
+    if args.cpu_affinity:
+        try:
+            cores = utils.parse_cpu_list(args.cpu_affinity)
+        except ValueError:
+            parser.error(f"invalid --cpu-affinity: {args.cpu_affinity}")
+    if not (args.batch or args.serve) and (args.input is None or args.output is None):
+        parser.error("--input and --output are required, without --batch or --serve")
+
+    from rich.console import Console
+    from rich.logging import RichHandler
+
+    # Only configure logging and the console when run as a script, not on import.
+    # In batch mode stdout carries the results, so everything else goes to stderr.
+    console = Console(stderr=args.batch)
+    logargs = {
+        "level": logging.INFO,
+        # "format": "%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s",
+        "format": "%(message)s",
+        "handlers": [RichHandler(console=console, rich_tracebacks=True)],
+    }
+    logging.basicConfig(**logargs)
 
     if args.log_file:
         file_handler = logging.FileHandler(args.log_file, mode="a")
@@ -208,30 +1194,66 @@ def main():
         )
         logging.getLogger().addHandler(file_handler)
 
-    input_file = args.input
+    # Pinned before the model is loaded, so torch starts its threads on these cores
+    threads = 8
+    if cores:
+        try:
+            threads = set_cpu_affinity(cores)
+        except OSError as e:
+            parser.error(f"cannot pin to CPU cores {args.cpu_affinity}: {e}")
+
+    if args.gpu_lock_dir:
+        # The device is selected once, the model is loaded on it later
+        select_device(threads=threads, gpu_lock_dir=args.gpu_lock_dir)
 
-    title = pyfiglet.figlet_format("WhisperNote", font="slant")
-    console.print(f"[bold red]{title}")
+    options = {
+        "threads": threads,
+        "language": args.language,
+        "model": args.model,
+        "word_timestamps": args.word_timestamps,
+        "condition_on_previous_text": args.condition_on_previous_text,
+        "beam_size": args.beam_size,
+        "greedy": args.greedy,
+        "backend": args.backend,
+        "compute_type": args.compute_type,
+        "chunk_batch_size": args.chunk_batch_size,
+        "audio_cache_dir": get_audio_cache_dir() if args.cache_audio else None,
+        "compile_model": args.compile,
+        "cpu_quant": args.cpu_quant,
+        "vad": args.vad,
+    }
+
+    console.print(f"[bold red]{utils.BANNER}")
     console.rule("[bold red]Trascription")
 
+    if args.batch:
+        failures = run_batch(
+            sys.stdin, sys.stdout, output_format=args.output_format, **options
+        )
+        sys.exit(1 if failures else 0)
+
+    if args.serve:
+        serve(args.serve, **options)
+        sys.exit(0)
+
+    input_file = args.input
+
     # Check if input file exists
     if not Path(input_file).is_file():
         logger.error(f"Input file {input_file} does not exist")
         raise FileNotFoundError(f"Input file {input_file} does not exist")
 
-    # Print duration of input file
-    print_duration(input_file)
-
-    results = transcribe(
-        input_audio_file_path=args.input,
-        language=args.language,
-        model=args.model,
-        word_timestamps=args.word_timestamps,
-        condition_on_previous_text=args.condition_on_previous_text,
-        beam_size=args.beam_size,
-    )
+    # Decoded once, for the duration of the input file and its transcription
+    audio = load_audio(input_file, cache_dir=options["audio_cache_dir"])
+    print_duration(audio)
 
-    write_output(args.output, results)
+    if args.output_format == "jsonl":
+        transcribe_jsonl(
+            args.output, input_audio_file_path=input_file, audio=audio, **options
+        )
+    else:
+        results = transcribe(input_audio_file_path=input_file, audio=audio, **options)
+        write_output(args.output, results, pretty=True)
 
     sys.exit(0)
 